@@ -0,0 +1,245 @@
+"""
+Bidding-war load generator for the auction path.
+
+N concurrent bidders fight over M published lots. Each round goes through the
+real handlers and middlewares: participate button -> bid amount message ->
+confirm button. Updates are fed with dp.feed_update. The database is a
+throwaway SQLite file, and Bot API calls go to fake_telegram.py running in the
+same process.
+
+Reports:
+- confirmed bids per second, plus rejected and failed rounds
+- p50/p95/p99 confirmation latency (confirm_bid update) and full round latency
+- lost bids (confirmed to the user but missing in the database), duplicate bids
+  and lots whose final price isn't their highest confirmed bid
+- channel edits and Bot API calls by method
+
+Usage:
+    python benchmark.py --lots 20 --bidders 200 --rounds 10 --api-latency 0.03
+Exit code is 1 if any bid was lost or duplicated, so it can guard changes to the bid path.
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a bidding war against a fake Bot API")
+    parser.add_argument('--lots', type=int, default=20, help="number of published auction lots")
+    parser.add_argument('--bidders', type=int, default=200, help="number of concurrent bidders")
+    parser.add_argument('--rounds', type=int, default=10, help="bids each bidder tries to place")
+    parser.add_argument('--think', type=float, default=0.0, help="max random pause between a bidder's steps, seconds")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="fake Bot API response latency, seconds")
+    parser.add_argument('--api-jitter', type=float, default=0.0, help="extra random Bot API latency, seconds")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="share of Bot API calls answered with 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of Bot API calls answered with 500")
+    parser.add_argument('--throttle', action='store_true', help="keep anti-flood limits (off by default)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show handler logs")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def configure_environment(db_path: str, api_port: int, throttle: bool):
+    """Point the bot at a throwaway database and the fake Bot API before project modules are imported"""
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{api_port}'
+    os.environ['BOT_TOKEN'] = '123456:BENCHMARK'
+    os.environ['CHANNEL_ID'] = '-1001234567890'
+    if not throttle:
+        os.environ['THROTTLE_LIMITS'] = ''
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def format_latency(values: List[float]) -> str:
+    return " ".join(f"p{q} {percentile(values, q) * 1000:.1f}ms" for q in (50, 95, 99)) + \
+        f" max {max(values, default=0) * 1000:.1f}ms"
+
+
+async def run(args, api_port: int) -> bool:
+    from aiogram.types import Update
+    from fake_telegram import FakeTelegram, make_callback_update, make_message_update
+
+    fake = FakeTelegram(
+        latency=args.api_latency, jitter=args.api_jitter,
+        flood_rate=args.flood_rate, error_rate=args.error_rate, seed=args.seed
+    )
+    runner = await fake.start(port=api_port)
+
+    import bot as bot_module
+    import loader
+    import config
+    from database import db
+    from outbox import outbox
+
+    bot = loader.bot
+    dp = loader.dp
+    bot_module.setup_dispatcher()
+    await db.init_db()
+
+    rng = random.Random(args.seed)
+
+    # Users and published lots
+    owner_id = 1
+    bidder_ids = list(range(1000, 1000 + args.bidders))
+    for user_id in [owner_id] + bidder_ids:
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}", f"+7700{user_id:07d}")
+
+    lot_ids = []
+    for i in range(args.lots):
+        lot_id = await db.create_lot(
+            owner_id=owner_id,
+            photos=f"photo_{i}",
+            description=f"Букет #{i}",
+            city="Алматы",
+            size="Средний",
+            wear="Сегодняшняя",
+            start_price=10000
+        )
+        await db.update_lot_status(lot_id, 'active')
+        await db.update_lot_field(lot_id, 'channel_message_id', 100000 + lot_id)
+        lot_ids.append(lot_id)
+
+    outbox.start()
+    fake.reset()
+
+    # Price each bidder believes a lot is at, like a user watching the channel
+    known_prices: Dict[int, float] = {lot_id: 10000 for lot_id in lot_ids}
+    # Confirmation message of every confirm_bid press: {message_id: (lot_id, user_id, amount)}
+    confirmations: Dict[int, Tuple[int, int, int]] = {}
+    confirm_latency: List[float] = []
+    round_latency: List[float] = []
+    failures = Counter()
+    message_ids = iter(range(10 ** 6, 10 ** 9))
+
+    async def feed(update: dict) -> float:
+        started = time.perf_counter()
+        await dp.feed_update(bot, Update.model_validate(dict(update, update_id=0), context={'bot': bot}))
+        return time.perf_counter() - started
+
+    async def pause():
+        if args.think:
+            await asyncio.sleep(rng.uniform(0, args.think))
+
+    async def bidder(user_id: int):
+        for _ in range(args.rounds):
+            lot_id = rng.choice(lot_ids)
+            amount = int(known_prices[lot_id]) + 500 * rng.randint(1, 3)
+            confirm_message_id = next(message_ids)
+            confirmations[confirm_message_id] = (lot_id, user_id, amount)
+
+            started = time.perf_counter()
+            try:
+                await feed(make_callback_update(user_id, f"participate:{lot_id}"))
+                await pause()
+                await feed(make_message_update(user_id, str(amount)))
+                await pause()
+                confirm_latency.append(await feed(
+                    make_callback_update(user_id, f"confirm_bid:{lot_id}:{amount}", message_id=confirm_message_id)
+                ))
+            except Exception as e:
+                failures[type(e).__name__] += 1
+                continue
+            round_latency.append(time.perf_counter() - started)
+            known_prices[lot_id] = max(known_prices[lot_id], amount)
+            await pause()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"Bidding war: {args.bidders} bidders x {args.rounds} rounds over {args.lots} lots "
+          f"(api latency {args.api_latency * 1000:.0f}ms, 429 rate {args.flood_rate}, 500 rate {args.error_rate})")
+    started = time.perf_counter()
+    await asyncio.gather(*(bidder(user_id) for user_id in bidder_ids))
+    elapsed = time.perf_counter() - started
+
+    # Outbid notifications still queued
+    await outbox.stop(timeout=30)
+
+    # Outcome of every confirm press as the user saw it
+    accepted = Counter()
+    rejected = 0
+    for call in fake.get_calls('editMessageText'):
+        entry = confirmations.get(call['params'].get('message_id'))
+        if entry is None or call['status'] != 200:
+            continue
+        if 'принята' in call['params'].get('text', ''):
+            accepted[entry] += 1
+        else:
+            rejected += 1
+
+    stored = Counter()
+    final_prices = {}
+    for lot_id in lot_ids:
+        for bid in await db.get_lot_bids(lot_id):
+            stored[(lot_id, bid['user_id'], int(bid['amount']))] += 1
+        final_prices[lot_id] = (await db.get_lot(lot_id))['current_price']
+
+    lost = [bid for bid in accepted if bid not in stored]
+    duplicates = [bid for bid, count in stored.items() if count > max(accepted.get(bid, 0), 1)]
+    unconfirmed = [bid for bid in stored if bid not in accepted]
+    highest = defaultdict(int)
+    for lot_id, _, amount in stored:
+        highest[lot_id] = max(highest[lot_id], amount)
+    wrong_prices = [lot_id for lot_id in lot_ids if highest[lot_id] and final_prices[lot_id] != highest[lot_id]]
+
+    channel = str(config.CHANNEL_ID)
+    channel_edits = Counter(
+        call['method'] for call in fake.calls
+        if call['method'].startswith('editMessage') and str(call['params'].get('chat_id')) == channel
+    )
+    api_calls = Counter(call['method'] for call in fake.calls if call['method'] != 'getUpdates')
+    api_errors = Counter(call['status'] for call in fake.calls if call['status'] != 200)
+
+    confirmed = sum(accepted.values())
+    print(f"\nConfirmed bids: {confirmed} in {elapsed:.2f}s ({confirmed / elapsed:.1f} bids/s)")
+    print(f"Rejected (outbid meanwhile): {rejected}, failed rounds: {sum(failures.values())} {dict(failures)}")
+    print(f"Confirmation latency: {format_latency(confirm_latency)}")
+    print(f"Round latency:        {format_latency(round_latency)}")
+    print(f"Lost bids: {len(lost)}, duplicate bids: {len(duplicates)}, "
+          f"stored but not confirmed: {len(unconfirmed)}, lots with wrong final price: {len(wrong_prices)}")
+    print(f"Channel edits: {sum(channel_edits.values())} {dict(channel_edits)}")
+    print(f"Bot API calls: {sum(api_calls.values())} {dict(api_calls.most_common())}")
+    if api_errors:
+        print(f"Bot API errors injected: {dict(api_errors)}")
+
+    await runner.cleanup()
+    await loader.storage.close()
+    await bot.session.close()
+
+    problems = len(lost) + len(duplicates) + len(wrong_prices)
+    print("\nOK" if not problems else "\nFAILED: bids were lost, duplicated or priced wrong")
+    return not problems
+
+
+def main():
+    args = parse_args()
+    api_port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(os.path.join(tmp, 'benchmark.db'), api_port, args.throttle)
+        ok = asyncio.run(run(args, api_port))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from cache import TTLCache
+import clock
+from database import db
+from metrics import Counter, Histogram
+from utils import MIN_BID_STEP, calculate_end_time, format_price, validate_bid
+import config
+
+logger = logging.getLogger(__name__)
+
+bids_total = Counter('bids_total', 'Bids by outcome', ('result',))
+bid_batch_size = Histogram('bid_batch_size', 'Bids stored per transaction', buckets=(1, 2, 5, 10, 20, 50, 100))
+bid_conflicts = Counter('bid_write_conflicts_total', 'Bid batches rejected because the lot changed underneath')
+proxy_bids_total = Counter('proxy_bids_total', 'Bids placed automatically on behalf of proxy bidders')
+
+# Writer tasks of all actors, shutdown waits for them
+_writers: Set[asyncio.Task] = set()
+
+# Columns of the lot owned by the actor and written with every batch
+BID_FIELDS = ('current_price', 'leader_id', 'auction_started', 'start_time', 'end_time', 'status')
+
+# build_notifications(outbid_user_ids, lot) -> outbox rows stored with the bid
+NotificationBuilder = Callable[[List[int], Dict[str, Any]], List[Dict[str, Any]]]
+
+# {user_id: (max_amount, placed_at)}
+Proxies = Dict[int, Tuple[float, str]]
+
+
+def resolve_proxies(current_price: float, leader_id: Optional[int], proxies: Proxies) -> List[Tuple[int, float]]:
+    """Bids the proxies place in answer to the standing bid, as (user_id, amount) in order.
+
+    The bidding war between proxies is settled in one go instead of step by step: the
+    highest maximum wins (ties go to the standing bid, then to the earlier proxy) and
+    pays one step over the runner-up's maximum, capped at its own. The runner-up's bid
+    at its maximum is recorded before the winning one.
+    """
+    ceilings = {user_id: max_amount for user_id, (max_amount, _) in proxies.items()}
+    placed = {user_id: placed_at for user_id, (_, placed_at) in proxies.items()}
+    if leader_id:
+        ceilings[leader_id] = max(ceilings.get(leader_id, 0), current_price)
+        placed[leader_id] = ''
+    if not ceilings:
+        return []
+
+    ranked = sorted(ceilings, key=lambda user_id: (-ceilings[user_id], placed[user_id]))
+    winner = ranked[0]
+    runner_up = ranked[1] if len(ranked) > 1 else None
+    required = current_price + MIN_BID_STEP
+
+    # How far the runner-up goes: the leader already stands at its price, a challenger needs a valid bid
+    contested = None
+    if runner_up is not None and (runner_up == leader_id or ceilings[runner_up] >= required):
+        contested = ceilings[runner_up]
+
+    if winner == leader_id:
+        if contested is None:
+            return []
+    elif ceilings[winner] < required:
+        return []
+
+    bids = []
+    if contested is not None and current_price < contested < ceilings[winner]:
+        bids.append((runner_up, contested))
+    standing = contested if contested is not None else current_price
+    bids.append((winner, min(ceilings[winner], standing + MIN_BID_STEP)))
+    return bids
+
+
+class LotActor:
+    """Owns the price, leader and participants of one lot.
+
+    Bids are validated and applied in memory without awaiting anything, so bids on a
+    lot take effect one at a time in arrival order. Accepted bids are written behind
+    in batches by the actor's writer task; place_bid returns once its batch is stored.
+    """
+
+    def __init__(self, lot: Dict[str, Any], participants: Set[int]):
+        self.lot_id = lot['id']
+        self.lot = lot
+        self.participants = participants
+        self.proxies: Proxies = {}
+        # Lot version in the database the in-memory state is based on
+        self.version = lot['version']
+        # Accepted in memory, not stored yet
+        self._pending: List[Dict[str, Any]] = []
+        self._writer: Optional[asyncio.Task] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copy of the lot as the actor sees it; version is dropped because unstored state has none"""
+        return dict(self.lot, version=None)
+
+    def _check_lot(self, user_id: int) -> Optional[str]:
+        """Why the user can't bid on the lot, None if they can"""
+        lot = self.lot
+        if lot['status'] not in ('approved', 'active'):
+            return "❌ Аукцион уже завершён."
+        if lot.get('lot_type') != 'auction':
+            return "❌ Это не аукцион!"
+        if lot['owner_id'] == user_id:
+            return "❌ Вы не можете участвовать в аукционе на свой букет!"
+        if lot.get('end_time') and clock.now() >= datetime.fromisoformat(lot['end_time']):
+            return "❌ Аукцион уже завершён."
+        return None
+
+    def check(self, user_id: int, amount: float) -> Optional[str]:
+        """Why the bid can't be placed, None if it can"""
+        error = self._check_lot(user_id)
+        if error:
+            return error
+
+        lot = self.lot
+        current_price = lot.get('current_price') or lot['start_price']
+        is_valid, error_msg = validate_bid(amount, lot['start_price'], current_price)
+        return None if is_valid else error_msg
+
+    def check_proxy(self, user_id: int, max_amount: float) -> Optional[str]:
+        """Why the proxy bid can't be set, None if it can"""
+        error = self._check_lot(user_id)
+        if error:
+            return error
+
+        lot = self.lot
+        current_price = lot.get('current_price') or lot['start_price']
+        proxy = self.proxies.get(user_id)
+        if proxy and max_amount <= proxy[0]:
+            return (f"❌ У вас уже стоит автоставка до {format_price(proxy[0])} сум.\n\n"
+                    "💡 Новый максимум должен быть выше.")
+        if lot.get('leader_id') == user_id:
+            if max_amount <= current_price:
+                return (f"❌ Максимум должен быть выше вашей текущей ставки "
+                        f"({format_price(current_price)} сум).")
+            return None
+        is_valid, error_msg = validate_bid(max_amount, lot['start_price'], current_price)
+        return None if is_valid else error_msg
+
+    def _apply(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a bid or a proxy bid to the in-memory state, returns the result reported to the user.
+
+        Proxies answer right away, so the entry may end up with several bids: the user's
+        own (if any) followed by those the proxies placed.
+        """
+        user_id = entry['user_id']
+        is_proxy = 'max_amount' in entry
+        if is_proxy:
+            error = self.check_proxy(user_id, entry['max_amount'])
+        else:
+            error = self.check(user_id, entry['amount'])
+        if error:
+            return {'accepted': False, 'error': error, 'lot': self.snapshot()}
+
+        lot = self.lot
+        previous_leader_id = lot.get('leader_id')
+        previous_price = lot.get('current_price')
+        # Proxies that could still bid before this entry
+        live_proxies = [
+            proxy_user_id for proxy_user_id, (max_amount, _) in self.proxies.items()
+            if max_amount >= (lot.get('current_price') or lot['start_price']) + MIN_BID_STEP
+        ]
+
+        bids = []
+        if is_proxy:
+            self.proxies[user_id] = (entry['max_amount'], entry['timestamp'])
+            live_proxies.append(user_id)
+        else:
+            bids.append((user_id, entry['amount']))
+            lot['current_price'] = entry['amount']
+            lot['leader_id'] = user_id
+        proxied = resolve_proxies(lot.get('current_price') or lot['start_price'], lot.get('leader_id'), self.proxies)
+        bids += proxied
+
+        auction_started = bool(bids) and not lot.get('auction_started')
+        if auction_started:
+            lot['auction_started'] = 1
+            lot['start_time'] = entry['timestamp']
+            lot['end_time'] = calculate_end_time().isoformat()
+            lot['status'] = 'active'
+        if bids:
+            lot['leader_id'], lot['current_price'] = bids[-1]
+            self.participants.update(bid_user_id for bid_user_id, _ in bids)
+
+        # Whoever led, bid or had a live proxy and can't keep up any more
+        outbid = [
+            outbid_user_id for outbid_user_id
+            in dict.fromkeys([previous_leader_id, *(bid_user_id for bid_user_id, _ in bids), *live_proxies])
+            if outbid_user_id and outbid_user_id != lot['leader_id']
+            and self.proxies.get(outbid_user_id, (0,))[0] < lot['current_price'] + MIN_BID_STEP
+        ]
+
+        result = {
+            'accepted': True,
+            'error': None,
+            'previous_leader_id': previous_leader_id,
+            'previous_price': previous_price,
+            'auction_started': auction_started,
+            'participants': len(self.participants),
+            'outbid': outbid,
+            'lot': self.snapshot()
+        }
+        entry['bids'] = [{'user_id': bid_user_id, 'amount': amount, 'timestamp': entry['timestamp']}
+                         for bid_user_id, amount in bids]
+        entry['proxies'] = [{'user_id': user_id, 'max_amount': entry['max_amount'],
+                             'placed_at': entry['timestamp']}] if is_proxy else []
+        entry['proxied'] = len(proxied)
+        build = entry['build_notifications']
+        entry['notifications'] = build(outbid, result['lot']) if build and outbid else []
+        return result
+
+    async def place_bid(self, user_id: int, amount: float,
+                        build_notifications: NotificationBuilder = None) -> Dict[str, Any]:
+        """Validate and apply a bid, returns its result once it is stored (or rejected)"""
+        return await self._submit({
+            'user_id': user_id,
+            'amount': amount,
+            'timestamp': clock.now().isoformat(),
+            'build_notifications': build_notifications
+        })
+
+    async def set_proxy(self, user_id: int, max_amount: float,
+                        build_notifications: NotificationBuilder = None) -> Dict[str, Any]:
+        """Set or raise the user's maximum, bidding for them right away if needed"""
+        return await self._submit({
+            'user_id': user_id,
+            'max_amount': max_amount,
+            'timestamp': clock.now().isoformat(),
+            'build_notifications': build_notifications
+        })
+
+    async def _submit(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        result = self._apply(entry)
+        if not result['accepted']:
+            bids_total.inc(result='rejected')
+            return result
+
+        entry['result'] = result
+        entry['future'] = asyncio.get_running_loop().create_future()
+        self._pending.append(entry)
+        if not self._writer:
+            self._writer = asyncio.create_task(self._write_behind())
+            _writers.add(self._writer)
+            self._writer.add_done_callback(_writers.discard)
+        return await entry['future']
+
+    async def _write_behind(self):
+        batch = []
+        try:
+            # Let bids arriving meanwhile join the batch
+            await asyncio.sleep(config.BID_BATCH_SECONDS)
+            while self._pending:
+                batch, self._pending = self._pending, []
+                await self._store(batch)
+        except Exception as e:
+            logger.exception(f"Failed to store bids on lot {self.lot_id}")
+            for entry in batch + self._pending:
+                if not entry['future'].done():
+                    entry['future'].set_exception(e)
+            self._pending = []
+            # Reload on the next bid instead of trusting state that wasn't stored
+            bid_book.forget(self.lot_id)
+        finally:
+            self._writer = None
+
+    async def _store(self, batch: List[Dict[str, Any]]):
+        bids = [bid for entry in batch for bid in entry['bids']]
+        stored = await db.store_bids(
+            self.lot_id,
+            self.version,
+            {field: self.lot.get(field) for field in BID_FIELDS},
+            bids,
+            [row for entry in batch for row in entry['notifications']],
+            [proxy for entry in batch for proxy in entry['proxies']]
+        )
+        if stored:
+            # The version trigger bumps the lot once per UPDATE
+            self.version += 1
+            self.lot['version'] = self.version
+            bid_batch_size.observe(len(bids))
+            bids_total.inc(len(bids), result='accepted')
+            proxy_bids_total.inc(sum(entry['proxied'] for entry in batch))
+            for entry in batch:
+                entry['future'].set_result(entry['result'])
+            return
+
+        # Someone else wrote the lot (admin action, completion, another instance):
+        # start over from the stored state and replay everything not stored yet in order
+        bid_conflicts.inc()
+        lot = await db.get_lot(self.lot_id)
+        replay = batch + self._pending
+        self._pending = []
+        if not lot:
+            for entry in replay:
+                bids_total.inc(result='rejected')
+                entry['future'].set_result({'accepted': False, 'error': "❌ Лот не найден.", 'lot': None})
+            bid_book.forget(self.lot_id)
+            return
+
+        self.lot = lot
+        self.version = lot['version']
+        self.proxies = await bid_book.load_proxies(self.lot_id)
+        for entry in replay:
+            result = self._apply(entry)
+            if result['accepted']:
+                entry['result'] = result
+                self._pending.append(entry)
+            else:
+                bids_total.inc(result='rejected')
+                entry['future'].set_result(result)
+
+    async def flush(self):
+        """Wait until every accepted bid is stored"""
+        while self._writer:
+            await asyncio.shield(self._writer)
+
+
+class BidBook:
+    """Actors of lots that are being bid on, loaded on first use"""
+
+    def __init__(self):
+        # Idle actors are dropped and reloaded from the database when needed again
+        self.actors = TTLCache('bid_actors', maxsize=config.STATE_CACHE_SIZE, ttl=config.BID_ACTOR_IDLE_SECONDS)
+        self._loading: Dict[int, asyncio.Task] = {}
+
+    async def _load(self, lot_id: int) -> Optional[LotActor]:
+        lot = await db.get_lot(lot_id)
+        if not lot:
+            return None
+        participants = {bid['user_id'] for bid in await db.get_lot_bids(lot_id)}
+        actor = LotActor(lot, participants)
+        actor.proxies = await self.load_proxies(lot_id)
+        self.actors.set(lot_id, actor)
+        return actor
+
+    @staticmethod
+    async def load_proxies(lot_id: int) -> Proxies:
+        return {proxy['user_id']: (proxy['max_amount'], proxy['placed_at'])
+                for proxy in await db.get_proxy_bids(lot_id)}
+
+    async def get_actor(self, lot_id: int) -> Optional[LotActor]:
+        actor = self.actors.get(lot_id)
+        if actor:
+            # Re-set on every use, so only idle actors expire and a live auction keeps its actor
+            self.actors.set(lot_id, actor)
+            return actor
+
+        # Bids arriving together share one load, so they end up in the same actor
+        task = self._loading.get(lot_id)
+        if task is None:
+            task = asyncio.create_task(self._load(lot_id))
+            self._loading[lot_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(lot_id, None))
+        return await asyncio.shield(task)
+
+    async def get_lot(self, lot_id: int) -> Optional[Dict[str, Any]]:
+        """Lot as the bidding actor sees it, including bids not stored yet"""
+        actor = await self.get_actor(lot_id)
+        return actor.snapshot() if actor else None
+
+    async def place_bid(self, lot_id: int, user_id: int, amount: float,
+                        build_notifications: NotificationBuilder = None) -> Optional[Dict[str, Any]]:
+        """Place a bid: {'accepted', 'error', 'previous_leader_id', 'auction_started', 'lot', ...}, None if no such lot"""
+        actor = await self.get_actor(lot_id)
+        if not actor:
+            return None
+        return await actor.place_bid(user_id, amount, build_notifications)
+
+    async def set_proxy(self, lot_id: int, user_id: int, max_amount: float,
+                        build_notifications: NotificationBuilder = None) -> Optional[Dict[str, Any]]:
+        """Set a proxy bid, same result as place_bid; None if no such lot"""
+        actor = await self.get_actor(lot_id)
+        if not actor:
+            return None
+        return await actor.set_proxy(user_id, max_amount, build_notifications)
+
+    def forget(self, lot_id: int):
+        self.actors.pop(lot_id)
+
+    async def flush_due(self, now: datetime):
+        """Store pending bids of auctions that reached their end time and drop their actors"""
+        for lot_id in self.actors.keys():
+            actor = self.actors.get(lot_id)
+            end_time = actor.lot.get('end_time') if actor else None
+            if end_time and datetime.fromisoformat(end_time) <= now:
+                await actor.flush()
+                self.forget(lot_id)
+        # Actors evicted from the cache may still be writing
+        if _writers:
+            await asyncio.wait(set(_writers))
+
+    async def close(self, timeout: float = None) -> bool:
+        """Store all pending bids, returns whether they made it within `timeout` seconds"""
+        if not _writers:
+            return True
+        _, pending = await asyncio.wait(set(_writers), timeout=timeout)
+        return not pending
+
+
+# Global bid book
+bid_book = BidBook()
@@ -1,11 +1,19 @@
+import time
+
+# Taken before the heavy imports, so startup timings include them
+started_at = time.monotonic()
+
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
+from bidding import bid_book
 import config
 from database import db
-from scheduler import start_scheduler, recover_active_auctions
+import loader
+from loader import bot, dp, storage
+from middlewares import ConcurrencyMiddleware, SessionMiddleware, ThrottlingMiddleware, setup_latency_middleware
+from outbox import outbox
+from scheduler import start_scheduler, stop_scheduler, recover_active_auctions
 
 # Configure logging
 logging.basicConfig(
@@ -13,25 +21,38 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-# Initialize bot and dispatcher
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# Bounded parallel handling, in order per user; shutdown waits for the updates it tracks
+concurrency = ConcurrencyMiddleware()
+
+# Background recovery of active auctions started by on_startup
+recovery_task = None
+
 
-# Bot username and ID will be set on startup
-bot_username = None
-bot_id = None
+async def check_channel():
+    """Make sure the bot can reach the auction channel"""
+    try:
+        return await bot.get_chat(config.CHANNEL_ID)
+    except Exception as e:
+        raise ValueError(f"❌ Cannot access channel {config.CHANNEL_ID}: {e}\n"
+                        f"Make sure the bot is added as admin to the channel!")
+
+
+async def recover_in_background():
+    """Complete overdue auctions and reschedule active ones while updates are already handled"""
+    started = time.monotonic()
+    try:
+        await recover_active_auctions()
+    except Exception:
+        # Overdue auctions are still picked up by the periodic completion sweep
+        logging.exception("Failed to recover active auctions")
+        return
+    logging.info(f"Active auctions recovered in {time.monotonic() - started:.2f}s")
 
 
 async def on_startup():
     """Actions on bot startup"""
-    global bot_username, bot_id
-
-    # Get bot username and ID
-    bot_info = await bot.get_me()
-    bot_username = bot_info.username
-    bot_id = bot_info.id
-    logging.info(f"Bot username: @{bot_username}, ID: {bot_id}")
+    global recovery_task
+    started = time.monotonic()
 
     # Validate configuration
     logging.info("Validating configuration...")
@@ -45,41 +66,78 @@ async def on_startup():
     if not config.ADMIN_PASSWORD or config.ADMIN_PASSWORD == "admin123":
         logging.warning("⚠️ ADMIN_PASSWORD not configured - using default password!")
 
-    # Test channel access
-    try:
-        channel_info = await bot.get_chat(config.CHANNEL_ID)
-        logging.info(f"✅ Channel '{channel_info.title}' ({config.CHANNEL_ID}) is accessible")
-    except Exception as e:
-        raise ValueError(f"❌ Cannot access channel {config.CHANNEL_ID}: {e}\n"
-                        f"Make sure the bot is added as admin to the channel!")
+    # Bot info, channel access and database setup don't depend on each other
+    bot_info, channel_info, _ = await asyncio.gather(bot.get_me(), check_channel(), db.init_db())
 
+    loader.bot_username = bot_info.username
+    loader.bot_id = bot_info.id
+    logging.info(f"Bot username: @{loader.bot_username}, ID: {loader.bot_id}")
+    logging.info(f"✅ Channel '{channel_info.title}' ({config.CHANNEL_ID}) is accessible")
     logging.info("✅ Configuration validated")
-
-    # Initialize database
-    await db.init_db()
     logging.info("Database initialized")
 
+    # Start notification delivery
+    outbox.start()
+    logging.info("Outbox worker started")
+
     # Start scheduler
     start_scheduler()
     logging.info("Scheduler started")
 
-    # Recover active auctions
-    await recover_active_auctions()
-    logging.info("Active auctions recovered")
+    # Overdue auctions are completed in the background, polling doesn't wait for them
+    recovery_task = asyncio.create_task(recover_in_background())
+
+    # Prometheus endpoint is optional, aiohttp.web is only imported when it's on
+    if config.METRICS_PORT:
+        from metrics_server import metrics_server
+        await metrics_server.start()
 
-    logging.info("🚀 Bot started successfully")
+    now = time.monotonic()
+    logging.info(f"🚀 Bot started successfully in {now - started:.2f}s ({now - started_at:.2f}s since launch)")
 
 
 async def on_shutdown():
-    """Actions on bot shutdown"""
+    """Actions on bot shutdown: no new updates arrive by now, let in-flight work finish"""
+    started = time.monotonic()
+    deadline = started + config.SHUTDOWN_TIMEOUT_SECONDS
+
+    def remaining() -> float:
+        return max(deadline - time.monotonic(), 0)
+
+    # Handlers, running scheduler jobs (completion fan-out, channel edits) and recovery
+    # finish side by side; the scheduler fires no new jobs meanwhile
+    background = [recovery_task] if recovery_task and not recovery_task.done() else []
+    updates_done, jobs_done, _ = await asyncio.gather(
+        concurrency.drain(remaining()),
+        stop_scheduler(remaining()),
+        asyncio.wait(background, timeout=remaining()) if background else asyncio.sleep(0)
+    )
+    if not updates_done:
+        logging.warning(f"⚠️ {concurrency.active} updates still in flight at shutdown")
+    if recovery_task and not recovery_task.done():
+        recovery_task.cancel()
+
+    # Bids accepted in memory are stored before the outbox delivers their notifications
+    if not await bid_book.close(remaining()):
+        logging.warning("⚠️ Some accepted bids were not stored before shutdown")
+
+    # Notifications queued by the work above go out in one last delivery pass
+    if not await outbox.stop(remaining()):
+        logging.warning("⚠️ Outbox delivery cut off at shutdown, leased notifications will be retried")
+
+    if config.METRICS_PORT:
+        from metrics_server import metrics_server
+        await metrics_server.stop()
+
+    await storage.close()
     await bot.session.close()
-    logging.info("Bot stopped")
+    logging.info(f"Bot stopped in {time.monotonic() - started:.2f}s")
 
 
-async def main():
-    """Main function"""
+def setup_dispatcher():
+    """Register routers and middlewares (also used by benchmark.py)"""
     # Register handlers
-    from handlers import registration, menu, lot_creation, admin, auction
+    from handlers import registration, menu, lot_creation, admin, auction, inline
 
     # IMPORTANT: Router order matters! Register from most specific to most general
 
@@ -95,16 +153,45 @@ async def main():
     # 4. Menu buttons (specific text matches like "💐 Выставить букет")
     dp.include_router(menu.router)
 
-    # 5. Auction handlers with awaiting_bids check (must be LAST to catch bid amounts)
+    # 5. Auction handlers with awaiting bid check (must be LAST to catch bid amounts)
     dp.include_router(auction.router)
 
+    # 6. Inline mode (@bot query), handles only inline queries
+    dp.include_router(inline.router)
+
+    # Bounded parallel handling, in order per user (registered first, so latency excludes queueing)
+    dp.update.outer_middleware(concurrency)
+
+    # Per-update latency with DB / Bot API breakdown, time-to-first-update in the log
+    setup_latency_middleware(dp, bot, started_at=started_at)
+
+    # Load user record and admin flag once per update (db_user, user_is_admin)
+    dp.update.outer_middleware(SessionMiddleware())
+
+    # Anti-flood for expensive actions (participate, contact seller, bids...)
+    throttling = ThrottlingMiddleware()
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+
+
+async def main():
+    """Main function"""
+    setup_dispatcher()
+
     # Register startup/shutdown handlers
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
-    # Start polling
+    # Receive updates (startup/shutdown hooks above are shared by both modes)
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if config.DELIVERY_MODE == 'webhook':
+            from webhook import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            # getUpdates doesn't work while a webhook is set
+            await bot.delete_webhook()
+            # Every update is handled in its own task (aiogram's default), ConcurrencyMiddleware bounds and orders them
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
         await bot.session.close()
 
@@ -0,0 +1,130 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from metrics import Counter, Gauge, collectors
+
+_MISSING = object()
+
+cache_entries = Gauge('bot_cache_entries', 'Entries held by in-process caches', ('cache',))
+cache_hits = Counter('bot_cache_hits_total', 'Cache lookups that found a live entry', ('cache',))
+cache_misses = Counter('bot_cache_misses_total', 'Cache lookups that found nothing', ('cache',))
+cache_evictions = Counter('bot_cache_evictions_total', 'Entries dropped by size cap or TTL', ('cache', 'reason'))
+cache_hit_ratio = Gauge('bot_cache_hit_ratio', 'Share of lookups that found a live entry since start', ('cache',))
+
+
+class TTLCache:
+    """Bounded in-memory cache: least recently used entries are evicted, entries expire after ttl seconds"""
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        caches.append(self)
+
+    def _expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+
+    def _resized(self):
+        cache_entries.set(len(self._data), cache=self.name)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            cache_misses.inc(cache=self.name)
+            return default
+
+        value, expires_at = entry
+        if self._expired(expires_at, time.monotonic()):
+            del self._data[key]
+            cache_evictions.inc(cache=self.name, reason='expired')
+            cache_misses.inc(cache=self.name)
+            self._resized()
+            return default
+
+        self._data.move_to_end(key)
+        cache_hits.inc(cache=self.name)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            cache_evictions.inc(cache=self.name, reason='size')
+        self._resized()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        self._resized()
+        return entry[0]
+
+    def keys(self) -> List[Hashable]:
+        """Keys of live entries, least recently used first"""
+        now = time.monotonic()
+        return [key for key, (_, expires_at) in self._data.items() if not self._expired(expires_at, now)]
+
+    def purge_expired(self) -> int:
+        """Drop expired entries that nobody asked for again, returns how many were dropped"""
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._data.items() if self._expired(expires_at, now)]
+        for key in expired:
+            del self._data[key]
+        if expired:
+            cache_evictions.inc(len(expired), cache=self.name, reason='expired')
+            self._resized()
+        return len(expired)
+
+    def clear(self):
+        self._data.clear()
+        self._resized()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# All caches created in the process; state keyed by users or lots belongs in one of them,
+# so memory stays flat however long the bot runs
+caches: List[TTLCache] = []
+
+
+def purge_expired_caches() -> int:
+    """Drop expired entries from every cache"""
+    return sum(cache.purge_expired() for cache in caches)
+
+
+def get_hit_ratio(cache: TTLCache) -> float:
+    hits = cache_hits.get(cache=cache.name)
+    misses = cache_misses.get(cache=cache.name)
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def collect_hit_ratios():
+    for cache in caches:
+        cache_hit_ratio.set(get_hit_ratio(cache), cache=cache.name)
+
+
+collectors.append(collect_hit_ratios)
+
+
+def get_cache_stats() -> List[Dict[str, Any]]:
+    """Size, limits, hit ratio and evictions of every cache"""
+    stats = []
+    for cache in caches:
+        stats.append({
+            'name': cache.name,
+            'entries': len(cache),
+            'maxsize': cache.maxsize,
+            'ttl': cache.ttl,
+            'hit_ratio': get_hit_ratio(cache),
+            'evicted_size': cache_evictions.get(cache=cache.name, reason='size'),
+            'evicted_expired': cache_evictions.get(cache=cache.name, reason='expired')
+        })
+    return stats
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from typing import Union
+
+
+class SystemClock:
+    """Real wall clock"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+
+class VirtualClock:
+    """Manually driven clock for simulations and tests"""
+
+    def __init__(self, start: datetime = None):
+        self._now = start or datetime.now()
+
+    def now(self) -> datetime:
+        return self._now
+
+    def advance(self, delta: Union[timedelta, float]):
+        """Move time forward by a timedelta or a number of seconds"""
+        if not isinstance(delta, timedelta):
+            delta = timedelta(seconds=delta)
+        self._now += delta
+
+    def set(self, moment: datetime):
+        """Jump to the given moment"""
+        self._now = moment
+
+
+# Clock used by scheduler, database timestamps and auction status formatting
+_clock = SystemClock()
+
+
+def now() -> datetime:
+    """Current time according to the active clock"""
+    return _clock.now()
+
+
+def set_clock(clock) -> None:
+    """Replace the active clock (e.g. with VirtualClock in simulations)"""
+    global _clock
+    _clock = clock
+
+
+def get_clock():
+    """Get the active clock"""
+    return _clock
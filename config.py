@@ -1,9 +1,12 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+# Bot API server, e.g. http://127.0.0.1:8081 for fake_telegram.py; empty means api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
 CHANNEL_ID = os.getenv('CHANNEL_ID')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'auction_bot.db')
@@ -16,6 +19,99 @@ AUCTION_DURATION_HOURS = int(os.getenv('AUCTION_DURATION_HOURS', 2))
 # Effective duration (in minutes)
 EFFECTIVE_AUCTION_DURATION_MINUTES = AUCTION_DURATION_MINUTES if AUCTION_DURATION_MINUTES is not None else AUCTION_DURATION_HOURS * 60
 
+# Update delivery: "polling" or "webhook"
+DELIVERY_MODE = os.getenv('DELIVERY_MODE', 'polling').lower()
+# Public HTTPS base URL registered with Telegram, leave empty to skip set_webhook (local testing)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', 8080))
+
+# FSM storage: states idle longer than the TTL are dropped, the cache keeps hot keys in memory;
+# its TTL bounds how long another instance's writes to a cached state go unnoticed
+FSM_STATE_TTL_SECONDS = int(os.getenv('FSM_STATE_TTL_SECONDS', 7 * 24 * 3600))
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+FSM_CACHE_TTL_SECONDS = float(os.getenv('FSM_CACHE_TTL_SECONDS', 5))
+
+# Rendered lot texts, keyed by lot version so entries never go stale; the TTL only frees memory
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 5000))
+RENDER_CACHE_TTL_SECONDS = int(os.getenv('RENDER_CACHE_TTL_SECONDS', 3600))
+
+# Inline mode: active lot index refresh, results per page, client cache time
+INLINE_INDEX_TTL_SECONDS = int(os.getenv('INLINE_INDEX_TTL_SECONDS', 30))
+INLINE_PAGE_SIZE = int(os.getenv('INLINE_PAGE_SIZE', 20))
+INLINE_CACHE_SECONDS = int(os.getenv('INLINE_CACHE_SECONDS', 30))
+
+# How long to wait for the rest of a photo album before handling it
+ALBUM_LATENCY_SECONDS = float(os.getenv('ALBUM_LATENCY_SECONDS', 0.6))
+
+# Updates handled in parallel (one user's updates are always handled in order)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 50))
+
+# Anti-flood: per user and action (callback data prefix or message handler name),
+# "action=rate/burst" pairs separated by commas, rate in actions per second
+THROTTLE_LIMITS = {
+    action: tuple(float(value) for value in limit.split('/'))
+    for action, limit in (
+        item.split('=') for item in os.getenv(
+            'THROTTLE_LIMITS',
+            'participate=0.5/3,contact_seller=0.033/2,confirm_bid=1/3,proxy_bid=1/3,change_bid=1/3,process_bid=1/5,'
+            'carousel=3/6,carousel_photos=0.2/2'
+        ).split(',') if item
+    )
+}
+THROTTLE_CACHE_SIZE = int(os.getenv('THROTTLE_CACHE_SIZE', 50000))
+THROTTLE_IDLE_SECONDS = int(os.getenv('THROTTLE_IDLE_SECONDS', 600))
+
+# In-process state keyed by lots or jobs: max entries; expired cache entries are purged periodically
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', 10000))
+CACHE_PURGE_SECONDS = int(os.getenv('CACHE_PURGE_SECONDS', 300))
+
+# Per-user session cache (user record and admin flag)
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+SESSION_CACHE_TTL_SECONDS = int(os.getenv('SESSION_CACHE_TTL_SECONDS', 300))
+
+# Bidding: accepted bids are stored in batches collected for up to BID_BATCH_SECONDS,
+# lots nobody bid on or opened a bid for in BID_ACTOR_IDLE_SECONDS are dropped from memory
+BID_BATCH_SECONDS = float(os.getenv('BID_BATCH_SECONDS', 0.01))
+BID_ACTOR_IDLE_SECONDS = int(os.getenv('BID_ACTOR_IDLE_SECONDS', 600))
+
+# Updates handled slower than this are logged with a DB / Bot API time breakdown
+SLOW_UPDATE_SECONDS = float(os.getenv('SLOW_UPDATE_SECONDS', 1))
+
+# Prometheus /metrics endpoint, disabled when METRICS_PORT is 0; binds to localhost by default
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv('LOOP_LAG_INTERVAL_SECONDS', 0.5))
+
+# Graceful shutdown: time for in-flight updates, scheduler jobs and queued notifications to finish
+# (kept under Docker's default 10s stop timeout)
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv('SHUTDOWN_TIMEOUT_SECONDS', 8))
+
+# Channel countdown refresh
+COUNTDOWN_REFRESH_SECONDS = int(os.getenv('COUNTDOWN_REFRESH_SECONDS', 30))
+CHANNEL_EDIT_WORKERS = int(os.getenv('CHANNEL_EDIT_WORKERS', 4))
+# Telegram throttles edits in a single channel, keep this conservative
+CHANNEL_EDITS_PER_SECOND = float(os.getenv('CHANNEL_EDITS_PER_SECOND', 3))
+
+# Instance identity and leases (several bot processes may share one database)
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+COMPLETION_LEASE_SECONDS = int(os.getenv('COMPLETION_LEASE_SECONDS', 300))
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 120))
+COMPLETION_SWEEP_SECONDS = int(os.getenv('COMPLETION_SWEEP_SECONDS', 60))
+
+# Scheduler monitoring: warn when a job starts later than this
+SCHEDULER_LAG_ALERT_SECONDS = float(os.getenv('SCHEDULER_LAG_ALERT_SECONDS', 5))
+
+# Notification outbox
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 2))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', 10))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_BACKOFF_SECONDS', 5))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', 600))
+
 # Payment settings
 PAYMENT_AMOUNT = 500  # тенге
 PAYMENT_CARD_NUMBER = os.getenv('PAYMENT_CARD_NUMBER')
@@ -1,9 +1,18 @@
 import aiosqlite
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
+import clock
 import config
+from metrics import Histogram
+from timing import timed_methods
 
+db_call_duration = Histogram('bot_db_call_seconds', 'Database method time', ('method',))
 
+# Lots browsable in the carousel: it shows a photo per lot, lots without one are left out
+CAROUSEL_LOTS = "status IN ('approved', 'active') AND photos != ''"
+
+
+# Time spent in every public method is added to the update being handled and to db_call_duration
+@timed_methods('db', db_call_duration)
 class Database:
     def __init__(self, db_path: str = config.DATABASE_PATH):
         self.db_path = db_path
@@ -74,6 +83,42 @@ class Database:
                 )
             ''')
 
+            # Proxy bids: the most a user is willing to pay, the bot bids on their behalf up to it
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS proxy_bids (
+                    lot_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    max_amount REAL NOT NULL,
+                    placed_at TEXT NOT NULL,
+                    PRIMARY KEY (lot_id, user_id),
+                    FOREIGN KEY (lot_id) REFERENCES lots(id),
+                    FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+                )
+            ''')
+
+            # Outbox table: notifications stored with the state change that caused them
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    parse_mode TEXT,
+                    reply_markup TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at TEXT NOT NULL,
+                    last_error TEXT,
+                    created_at TEXT NOT NULL,
+                    sent_at TEXT
+                )
+            ''')
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_lots_status_id ON lots (status, id)'
+            )
+
             # Migration: Add channel_button_message_id if it doesn't exist
             try:
                 await db.execute('ALTER TABLE lots ADD COLUMN channel_button_message_id INTEGER')
@@ -98,6 +143,42 @@ class Database:
                 # Column already exists
                 pass
 
+            # Migration: Add completion lease columns to lots if they don't exist
+            for column in ('lease_owner TEXT', 'lease_expires_at TEXT'):
+                try:
+                    await db.execute(f'ALTER TABLE lots ADD COLUMN {column}')
+                    await db.commit()
+                except aiosqlite.OperationalError:
+                    # Column already exists
+                    pass
+
+            # Migration: Add delivery lease columns to outbox if they don't exist
+            for column in ('lease_owner TEXT', 'lease_expires_at TEXT'):
+                try:
+                    await db.execute(f'ALTER TABLE outbox ADD COLUMN {column}')
+                    await db.commit()
+                except aiosqlite.OperationalError:
+                    # Column already exists
+                    pass
+
+            # Migration: Add lot version counter if it doesn't exist
+            try:
+                await db.execute('ALTER TABLE lots ADD COLUMN version INTEGER DEFAULT 1')
+                await db.commit()
+            except aiosqlite.OperationalError:
+                # Column already exists
+                pass
+
+            # Every write to a lot bumps its version, including raw UPDATEs in handlers,
+            # so rendered captions keyed by version never go stale
+            await db.execute('''
+                CREATE TRIGGER IF NOT EXISTS lots_bump_version
+                AFTER UPDATE ON lots FOR EACH ROW WHEN NEW.version IS OLD.version
+                BEGIN
+                    UPDATE lots SET version = COALESCE(OLD.version, 1) + 1 WHERE id = NEW.id;
+                END
+            ''')
+
             await db.commit()
 
     # User methods
@@ -107,7 +188,7 @@ class Database:
             async with aiosqlite.connect(self.db_path) as db:
                 await db.execute(
                     'INSERT INTO users (telegram_id, username, name, phone, reg_date) VALUES (?, ?, ?, ?, ?)',
-                    (telegram_id, username, name, phone, datetime.now().isoformat())
+                    (telegram_id, username, name, phone, clock.now().isoformat())
                 )
                 await db.commit()
                 return True
@@ -122,6 +203,18 @@ class Database:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
+    async def get_users(self, telegram_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Get several users at once: {telegram_id: user}"""
+        if not telegram_ids:
+            return {}
+        ids = list(set(telegram_ids))
+        placeholders = ','.join('?' * len(ids))
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(f'SELECT * FROM users WHERE telegram_id IN ({placeholders})', ids) as cursor:
+                rows = await cursor.fetchall()
+                return {row['telegram_id']: dict(row) for row in rows}
+
     async def is_user_registered(self, telegram_id: int) -> bool:
         """Check if user is registered"""
         user = await self.get_user(telegram_id)
@@ -153,7 +246,7 @@ class Database:
                    start_price, current_price, created_at, status)
                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                 (owner_id, lot_type, photos, description, city, size, wear, start_price,
-                 start_price, datetime.now().isoformat(), 'pending')
+                 start_price, clock.now().isoformat(), 'pending')
             )
             await db.commit()
             return cursor.lastrowid
@@ -199,17 +292,6 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
-    async def start_auction(self, lot_id: int, start_time: str, end_time: str) -> bool:
-        """Mark auction as started"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                '''UPDATE lots SET auction_started = 1, start_time = ?,
-                   end_time = ?, status = 'active' WHERE id = ?''',
-                (start_time, end_time, lot_id)
-            )
-            await db.commit()
-            return True
-
     async def get_active_auctions(self) -> List[Dict[str, Any]]:
         """Get all active auctions"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -221,6 +303,95 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
+    async def claim_due_auctions(self, now: str, owner: str, lease_until: str) -> List[Dict[str, Any]]:
+        """Atomically claim ended auctions for completion by `owner`.
+
+        A lot is claimed by moving it from 'active' to 'completing' with a lease;
+        lots whose lease expired (the claimant died) can be claimed again.
+        Returns the lots currently leased by `owner`.
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            await db.execute(
+                '''UPDATE lots SET status = 'completing', lease_owner = ?, lease_expires_at = ?
+                   WHERE auction_started = 1 AND end_time <= ?
+                   AND (status = 'active' OR (status = 'completing' AND lease_expires_at <= ?))''',
+                (owner, lease_until, now, now)
+            )
+            await db.commit()
+            async with db.execute(
+                "SELECT * FROM lots WHERE status = 'completing' AND lease_owner = ?",
+                (owner,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def finalize_claimed_auctions(self, lot_ids: List[int], owner: str,
+                                        build_notifications: Callable = None) -> List[Dict[str, Any]]:
+        """Finish auctions claimed by `owner` in one transaction.
+
+        build_notifications(lots, users, admin_ids) returns outbox messages that are
+        written in the same transaction. Lots whose lease was taken over by another
+        instance are skipped. Returns the finalized lots with their new status and
+        'participants' list.
+        """
+        if not lot_ids:
+            return []
+
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            # Take the write lock up front so the lease can't change under us
+            await db.execute('BEGIN IMMEDIATE')
+            placeholders = ','.join('?' * len(lot_ids))
+            async with db.execute(
+                f"SELECT * FROM lots WHERE id IN ({placeholders}) AND status = 'completing' AND lease_owner = ?",
+                (*lot_ids, owner)
+            ) as cursor:
+                lots = [dict(row) for row in await cursor.fetchall()]
+
+            if not lots:
+                await db.commit()
+                return []
+
+            lot_ids = [lot['id'] for lot in lots]
+            placeholders = ','.join('?' * len(lot_ids))
+            participants: Dict[int, List[int]] = {lot_id: [] for lot_id in lot_ids}
+            async with db.execute(
+                f'SELECT DISTINCT lot_id, user_id FROM bids WHERE lot_id IN ({placeholders})',
+                lot_ids
+            ) as cursor:
+                for row in await cursor.fetchall():
+                    participants[row['lot_id']].append(row['user_id'])
+
+            for lot in lots:
+                lot['participants'] = participants[lot['id']]
+                lot['status'] = 'finished' if lot['participants'] else 'no_bids'
+
+            await db.executemany(
+                'UPDATE lots SET status = ? WHERE id = ?',
+                [(lot['status'], lot['id']) for lot in lots]
+            )
+
+            if build_notifications:
+                user_ids = set()
+                for lot in lots:
+                    user_ids.add(lot['owner_id'])
+                    if lot.get('leader_id'):
+                        user_ids.add(lot['leader_id'])
+                user_placeholders = ','.join('?' * len(user_ids))
+                async with db.execute(
+                    f'SELECT * FROM users WHERE telegram_id IN ({user_placeholders})',
+                    list(user_ids)
+                ) as cursor:
+                    users = {row['telegram_id']: dict(row) for row in await cursor.fetchall()}
+                async with db.execute('SELECT telegram_id FROM admins') as cursor:
+                    admin_ids = [row[0] for row in await cursor.fetchall()]
+
+                await self._insert_notifications(db, build_notifications(lots, users, admin_ids))
+
+            await db.commit()
+            return lots
+
     async def get_all_active_lots(self) -> List[Dict[str, Any]]:
         """Get all active and approved lots (for viewing in bot)"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -231,22 +402,84 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
+    async def get_active_lot_page(self, lot_id: int = None, direction: str = 'next') -> Optional[Dict[str, Any]]:
+        """Keyset pagination over active and approved lots with photos, newest first
+
+        'next' returns the lot right after lot_id (older), 'prev' the one before it (newer),
+        without lot_id the newest lot is returned.
+        """
+        if lot_id is None:
+            query = f"SELECT * FROM lots WHERE {CAROUSEL_LOTS} ORDER BY id DESC LIMIT 1"
+            params = ()
+        elif direction == 'prev':
+            query = f"SELECT * FROM lots WHERE {CAROUSEL_LOTS} AND id > ? ORDER BY id ASC LIMIT 1"
+            params = (lot_id,)
+        else:
+            query = f"SELECT * FROM lots WHERE {CAROUSEL_LOTS} AND id < ? ORDER BY id DESC LIMIT 1"
+            params = (lot_id,)
+
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, params) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def get_active_lot_position(self, lot_id: int) -> tuple:
+        """Position of the lot among carousel lots (1 = newest) and their total count"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(id >= ?), 0) FROM lots WHERE {CAROUSEL_LOTS}",
+                (lot_id,)
+            ) as cursor:
+                total, position = await cursor.fetchone()
+                return position, total
+
     # Bid methods
-    async def add_bid(self, lot_id: int, user_id: int, amount: float) -> bool:
-        """Add new bid"""
+    async def store_bids(self, lot_id: int, version: int, lot_fields: Dict[str, Any],
+                         bids: List[Dict[str, Any]], notifications: List[Dict[str, Any]] = None,
+                         proxies: List[Dict[str, Any]] = None) -> bool:
+        """Write a batch of bids and proxy bids on one lot with its new state in one transaction.
+
+        The lot is only updated if it is still live and at `version`, i.e. nobody else
+        wrote it since the caller read it. Returns False (and writes nothing) otherwise.
+        """
+        assignments = ', '.join(f'{column} = ?' for column in lot_fields)
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                'INSERT INTO bids (lot_id, user_id, amount, timestamp) VALUES (?, ?, ?, ?)',
-                (lot_id, user_id, amount, datetime.now().isoformat())
+            cursor = await db.execute(
+                f"UPDATE lots SET {assignments} WHERE id = ? AND version = ? AND status IN ('approved', 'active')",
+                (*lot_fields.values(), lot_id, version)
             )
-            # Update lot current price and leader
-            await db.execute(
-                'UPDATE lots SET current_price = ?, leader_id = ? WHERE id = ?',
-                (amount, user_id, lot_id)
+            if cursor.rowcount != 1:
+                await db.rollback()
+                return False
+
+            await db.executemany(
+                'INSERT INTO bids (lot_id, user_id, amount, timestamp) VALUES (?, ?, ?, ?)',
+                [(lot_id, bid['user_id'], bid['amount'], bid['timestamp']) for bid in bids]
             )
+            if proxies:
+                await db.executemany(
+                    '''INSERT INTO proxy_bids (lot_id, user_id, max_amount, placed_at) VALUES (?, ?, ?, ?)
+                       ON CONFLICT (lot_id, user_id) DO UPDATE SET
+                           max_amount = excluded.max_amount, placed_at = excluded.placed_at''',
+                    [(lot_id, proxy['user_id'], proxy['max_amount'], proxy['placed_at']) for proxy in proxies]
+                )
+            if notifications:
+                await self._insert_notifications(db, notifications)
             await db.commit()
             return True
 
+    async def get_proxy_bids(self, lot_id: int) -> List[Dict[str, Any]]:
+        """Get all proxy bids for a lot, earliest first"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                'SELECT * FROM proxy_bids WHERE lot_id = ? ORDER BY placed_at',
+                (lot_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
     async def get_lot_bids(self, lot_id: int) -> List[Dict[str, Any]]:
         """Get all bids for a lot"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -283,10 +516,94 @@ class Database:
         """Delete lot and its bids"""
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute('DELETE FROM bids WHERE lot_id = ?', (lot_id,))
+            await db.execute('DELETE FROM proxy_bids WHERE lot_id = ?', (lot_id,))
             await db.execute('DELETE FROM lots WHERE id = ?', (lot_id,))
             await db.commit()
             return True
 
+    # Outbox methods
+    async def _insert_notifications(self, db: aiosqlite.Connection, notifications: List[Dict[str, Any]]):
+        """Insert outbox rows using an open connection (caller commits)"""
+        now = clock.now().isoformat()
+        await db.executemany(
+            '''INSERT INTO outbox (chat_id, text, parse_mode, reply_markup, next_attempt_at, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            [(n['chat_id'], n['text'], n.get('parse_mode'), n.get('reply_markup'), now, now)
+             for n in notifications]
+        )
+
+    async def enqueue_notifications(self, notifications: List[Dict[str, Any]]) -> bool:
+        """Add notifications to the outbox"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await self._insert_notifications(db, notifications)
+            await db.commit()
+            return True
+
+    async def claim_due_notifications(self, now: str, owner: str, lease_until: str,
+                                      limit: int = 50) -> List[Dict[str, Any]]:
+        """Lease due notifications to `owner` so that only one instance delivers them.
+
+        Notifications left in 'sending' by a dead instance are claimed again
+        once their lease expires.
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            await db.execute(
+                '''UPDATE outbox SET status = 'sending', lease_owner = ?, lease_expires_at = ?
+                   WHERE id IN (
+                       SELECT id FROM outbox
+                       WHERE (status = 'pending' AND next_attempt_at <= ?)
+                       OR (status = 'sending' AND lease_expires_at <= ?)
+                       ORDER BY id LIMIT ?
+                   )''',
+                (owner, lease_until, now, now, limit)
+            )
+            await db.commit()
+            async with db.execute(
+                "SELECT * FROM outbox WHERE status = 'sending' AND lease_owner = ? ORDER BY id LIMIT ?",
+                (owner, limit)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def mark_notification_sent(self, notification_id: int) -> bool:
+        """Mark notification as delivered"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE outbox SET status = 'sent', sent_at = ? WHERE id = ?",
+                (clock.now().isoformat(), notification_id)
+            )
+            await db.commit()
+            return True
+
+    async def mark_notification_failed(self, notification_id: int, attempts: int, next_attempt_at: str,
+                                       error: str, dead: bool = False) -> bool:
+        """Record failed delivery attempt, dead letters are not retried anymore"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                'UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                ('dead' if dead else 'pending', attempts, next_attempt_at, error, notification_id)
+            )
+            await db.commit()
+            return True
+
+    async def replay_dead_notifications(self) -> int:
+        """Put all dead letters back to the queue, returns how many were replayed"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE status = 'dead'",
+                (clock.now().isoformat(),)
+            )
+            await db.commit()
+            return cursor.rowcount or 0
+
+    async def get_outbox_stats(self) -> Dict[str, int]:
+        """Count outbox notifications by status"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status') as cursor:
+                rows = await cursor.fetchall()
+                return {row[0]: row[1] for row in rows}
+
     # Admin methods
     async def add_admin(self, telegram_id: int, username: str = None) -> bool:
         """Add user to admins"""
@@ -294,7 +611,7 @@ class Database:
             async with aiosqlite.connect(self.db_path) as db:
                 await db.execute(
                     'INSERT INTO admins (telegram_id, username, auth_date) VALUES (?, ?, ?)',
-                    (telegram_id, username, datetime.now().isoformat())
+                    (telegram_id, username, clock.now().isoformat())
                 )
                 await db.commit()
                 return True
@@ -0,0 +1,307 @@
+"""
+Local stand-in for the Telegram Bot API, for end-to-end and load testing.
+
+An aiohttp app that serves /bot<token>/<method> the way api.telegram.org does.
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:8081 and it never
+talks to real Telegram.
+
+- Updates are injected with FakeTelegram.inject_update() or POST /_fake/updates.
+  They go to getUpdates long polling, or to the webhook registered with setWebhook.
+- Implemented: getMe, getChat, getUpdates, setWebhook, deleteWebhook, sendMessage,
+  sendPhoto, sendMediaGroup, editMessageCaption, editMessageText,
+  editMessageReplyMarkup, editMessageMedia, copyMessage, copyMessages,
+  deleteMessage, answerCallbackQuery and answerInlineQuery. Other methods get 404.
+- Configurable response latency, 429 "retry after" injection and a server error rate.
+- Every call is recorded with its parameters and outcome: FakeTelegram.calls,
+  GET /_fake/calls, DELETE /_fake/calls.
+
+Usage:
+    python fake_telegram.py --port 8081 --latency 0.05 --flood-rate 0.01 --error-rate 0.005
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+from aiohttp import ClientSession, web
+
+logger = logging.getLogger(__name__)
+
+# Parameters that are always strings even when they look like numbers
+TEXT_PARAMS = {'text', 'caption', 'callback_query_id', 'inline_query_id', 'url', 'secret_token', 'next_offset'}
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_auction_bot'}
+
+
+def parse_value(name: str, value: Any) -> Any:
+    """Decode a form field the way aiogram encoded it: JSON for objects, plain strings otherwise"""
+    if not isinstance(value, str) or name in TEXT_PARAMS:
+        return value
+    if value[:1] in ('{', '['):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    if re.fullmatch(r'-?\d+', value):
+        return int(value)
+    if value in ('true', 'false'):
+        return value == 'true'
+    return value
+
+
+def make_user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'user{user_id}'}
+
+
+def make_message_update(user_id: int, text: str) -> Dict[str, Any]:
+    """Private text message from a user, without update_id (added on injection)"""
+    return {
+        'message': {
+            'message_id': random.randint(1, 2 ** 31),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': make_user(user_id),
+            'text': text
+        }
+    }
+
+
+def make_callback_update(user_id: int, data: str, message_id: int = 1) -> Dict[str, Any]:
+    """Inline button press by a user, without update_id (added on injection)"""
+    return {
+        'callback_query': {
+            'id': str(random.randint(1, 2 ** 62)),
+            'from': make_user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'button'
+            }
+        }
+    }
+
+
+class FakeTelegram:
+    """State of the fake Bot API: pending updates, webhook, message ids and the call log"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0.0,
+                 retry_after: int = 1, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        # [{'method', 'params', 'status', 'at'}] in arrival order
+        self.calls: List[Dict[str, Any]] = []
+        self.updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self._webhook_session: Optional[ClientSession] = None
+
+    # Inspection helpers for tests
+
+    def get_calls(self, method: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Recorded calls, optionally of one method only"""
+        return [call for call in self.calls if method is None or call['method'] == method]
+
+    def count(self, method: Optional[str] = None, status: int = 200) -> int:
+        return sum(1 for call in self.get_calls(method) if call['status'] == status)
+
+    def reset(self):
+        self.calls.clear()
+
+    # Update injection
+
+    async def inject_update(self, update: Dict[str, Any]) -> int:
+        """Deliver an update to the bot: to its webhook if one is set, else to getUpdates"""
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url:
+            if self._webhook_session is None:
+                self._webhook_session = ClientSession()
+            headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret} if self.webhook_secret else {}
+            async with self._webhook_session.post(self.webhook_url, json=update, headers=headers) as response:
+                if response.status != 200:
+                    logger.warning(f"Webhook answered {response.status} to update {update['update_id']}")
+        else:
+            self.updates.append(update)
+            self._new_updates.set()
+        return update['update_id']
+
+    async def close(self):
+        if self._webhook_session:
+            await self._webhook_session.close()
+            self._webhook_session = None
+
+    # Bot API
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        chat_type = 'private' if isinstance(chat_id, int) and chat_id > 0 else 'channel'
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id if isinstance(chat_id, int) else -100, 'type': chat_type},
+            'from': BOT_USER
+        }
+        # Like Telegram, only inline keyboards are echoed back in the sent message
+        markup = fields.pop('reply_markup', None)
+        if isinstance(markup, dict) and 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        message.update({key: value for key, value in fields.items() if value is not None})
+        return message
+
+    def _photo(self, photo: Any) -> List[Dict[str, Any]]:
+        file_id = photo if isinstance(photo, str) else f'uploaded_{next(self._message_ids)}'
+        return [{'file_id': file_id, 'file_unique_id': file_id[-16:], 'width': 1280, 'height': 960}]
+
+    async def get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = params.get('offset')
+        if offset:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=params.get('timeout') or 0)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:params.get('limit') or 100]
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """Result of a Bot API method, raises KeyError for methods that aren't implemented"""
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getChat':
+            return {'id': -100, 'type': 'channel', 'title': str(params.get('chat_id')),
+                    'accent_color_id': 0, 'max_reaction_count': 11}
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.webhook_secret = params.get('secret_token')
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = self.webhook_secret = None
+            return True
+        if method == 'sendMessage':
+            return self._message(params.get('chat_id'), text=params.get('text'),
+                                 reply_markup=params.get('reply_markup'))
+        if method == 'sendPhoto':
+            return self._message(params.get('chat_id'), photo=self._photo(params.get('photo')),
+                                 caption=params.get('caption'), reply_markup=params.get('reply_markup'))
+        if method == 'sendMediaGroup':
+            group_id = str(next(self._message_ids))
+            return [
+                self._message(params.get('chat_id'), media_group_id=group_id,
+                              photo=self._photo(media.get('media')), caption=media.get('caption'))
+                for media in params.get('media') or []
+            ]
+        if method in ('editMessageCaption', 'editMessageText', 'editMessageReplyMarkup', 'editMessageMedia'):
+            if params.get('inline_message_id'):
+                return True
+            message = self._message(params.get('chat_id'), text=params.get('text'), caption=params.get('caption'),
+                                    reply_markup=params.get('reply_markup'))
+            message['message_id'] = params.get('message_id')
+            return message
+        if method == 'copyMessage':
+            return {'message_id': next(self._message_ids)}
+        if method == 'copyMessages':
+            return [{'message_id': next(self._message_ids)} for _ in params.get('message_ids') or []]
+        if method in ('deleteMessage', 'answerCallbackQuery', 'answerInlineQuery'):
+            return True
+        raise KeyError(method)
+
+    # HTTP
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = {name: parse_value(name, value) for name, value in (await request.post()).items()}
+        if request.query:
+            params.update({name: parse_value(name, value) for name, value in request.query.items()})
+        # Uploaded files are recorded by name
+        params = {name: getattr(value, 'filename', value) for name, value in params.items()}
+
+        if method != 'getUpdates':
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+
+        status, payload = await self._respond(method, params)
+        self.calls.append({'method': method, 'params': params, 'status': status, 'at': time.monotonic()})
+        return web.json_response(payload, status=status)
+
+    async def _respond(self, method: str, params: Dict[str, Any]):
+        if method not in ('getUpdates', 'getMe'):
+            if self.random.random() < self.flood_rate:
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f'Too Many Requests: retry after {self.retry_after}',
+                             'parameters': {'retry_after': self.retry_after}}
+            if self.random.random() < self.error_rate:
+                return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+        try:
+            result = await self.call(method, params)
+        except KeyError:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        return 200, {'ok': True, 'result': result}
+
+    async def handle_inject(self, request: web.Request) -> web.Response:
+        update_id = await self.inject_update(await request.json())
+        return web.json_response({'ok': True, 'update_id': update_id})
+
+    async def handle_calls(self, request: web.Request) -> web.Response:
+        if request.method == 'DELETE':
+            self.reset()
+            return web.json_response({'ok': True})
+        return web.json_response(self.get_calls(request.query.get('method')))
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/_fake/updates', self.handle_inject)
+        app.router.add_get('/_fake/calls', self.handle_calls)
+        app.router.add_delete('/_fake/calls', self.handle_calls)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+        app.on_cleanup.append(lambda _: self.close())
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081) -> web.AppRunner:
+        """Serve in the running loop, returns the runner to clean up"""
+        runner = web.AppRunner(self.create_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a fake Telegram Bot API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after of injected 429s")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of calls answered with 500")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeTelegram(args.latency, args.jitter, args.flood_rate, args.retry_after, args.error_rate, args.seed)
+    print(f"Fake Bot API on http://{args.host}:{args.port} - start the bot with TELEGRAM_API_URL=http://{args.host}:{args.port}")
+    web.run_app(fake.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,10 @@ from aiogram.fsm.context import FSMContext
 import aiosqlite
 
 from database import db
+from middlewares.session import invalidate_session
+from outbox import outbox
 from keyboards import get_participate_keyboard, get_buy_keyboard, get_rejection_reasons_keyboard, get_confirm_rejection_keyboard, get_moderation_keyboard, get_admin_menu, get_main_menu, get_admin_lot_actions_keyboard
-from utils import is_admin, format_lot_message, get_photos_list, format_auction_status, format_price
+from utils import format_lot_message, get_photos_list, format_auction_status, format_price
 from states import AdminAuth, AdminModeration
 import config
 
@@ -14,9 +16,9 @@ router = Router()
 
 
 @router.message(F.text == "👤 Режим пользователя")
-async def switch_to_user_mode(message: Message):
+async def switch_to_user_mode(message: Message, user_is_admin: bool = False):
     """Switch admin to user mode"""
-    if not await is_admin(message.from_user.id):
+    if not user_is_admin:
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -30,9 +32,9 @@ async def switch_to_user_mode(message: Message):
 
 
 @router.message(F.text == "⚙️ Режим администратора")
-async def switch_to_admin_mode(message: Message):
+async def switch_to_admin_mode(message: Message, user_is_admin: bool = False):
     """Switch user to admin mode"""
-    if not await is_admin(message.from_user.id):
+    if not user_is_admin:
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -45,14 +47,14 @@ async def switch_to_admin_mode(message: Message):
 
 
 @router.message(Command("admin"))
-async def cmd_admin(message: Message, state: FSMContext):
+async def cmd_admin(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Handle /admin command"""
     import logging
     logger = logging.getLogger(__name__)
     logger.info(f"🔧 /admin command received from user {message.from_user.id}")
 
     # Check if already admin
-    if await is_admin(message.from_user.id):
+    if user_is_admin:
         await message.answer(
             "✅ Вы уже авторизованы как администратор!",
             reply_markup=get_admin_menu()
@@ -79,6 +81,7 @@ async def process_admin_password(message: Message, state: FSMContext):
         # Add user as admin
         username = message.from_user.username
         success = await db.add_admin(message.from_user.id, username)
+        invalidate_session(message.from_user.id)
 
         if success:
             await message.answer(
@@ -100,10 +103,104 @@ async def process_admin_password(message: Message, state: FSMContext):
         await state.clear()
 
 
+@router.message(Command("replay_dead"))
+async def cmd_replay_dead(message: Message, user_is_admin: bool = False):
+    """Put undelivered notifications (dead letters) back to the outbox queue"""
+    if not user_is_admin:
+        await message.answer("❌ У вас нет прав администратора!")
+        return
+
+    replayed = await db.replay_dead_notifications()
+    outbox.wake()
+
+    stats = await db.get_outbox_stats()
+    await message.answer(
+        f"📬 <b>Очередь уведомлений</b>\n\n"
+        f"🔁 Возвращено в очередь: {replayed}\n"
+        f"⏳ Ожидают отправки: {stats.get('pending', 0)}\n"
+        f"✅ Доставлено: {stats.get('sent', 0)}",
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("scheduler_stats"))
+async def cmd_scheduler_stats(message: Message, user_is_admin: bool = False):
+    """Show scheduler lag, duration and failure metrics"""
+    if not user_is_admin:
+        await message.answer("❌ У вас нет прав администратора!")
+        return
+
+    from scheduler import get_scheduler_stats
+
+    stats = get_scheduler_stats()
+    kind_names = {
+        "completion": "🏁 Завершение",
+        "sweep": "🧹 Проверка завершений",
+        "update": "⏱ Обновление канала",
+        "notify": "🔔 Напоминания",
+        "maintenance": "🗑 Очистка кэшей"
+    }
+
+    text = "⏰ <b>Планировщик</b>\n\n"
+    text += f"Ожидающих задач: {stats['pending_timers']}\n"
+
+    for kind, kind_stats in stats['kinds'].items():
+        lag = kind_stats['lag']
+        duration = kind_stats['duration']
+        text += f"\n<b>{kind_names[kind]}</b>\n"
+        text += f"Запусков: {duration['count']}, ошибок: {int(kind_stats['failures'])}, пропущено: {int(kind_stats['missed'])}\n"
+        if duration['count']:
+            text += f"Задержка: ср. {lag['avg']:.2f}с, p95 {lag['p95']:.2f}с, макс. {lag['max']:.2f}с\n"
+            text += f"Выполнение: ср. {duration['avg']:.2f}с, p95 {duration['p95']:.2f}с\n"
+
+    await message.answer(text, parse_mode="HTML")
+
+
+@router.message(Command("handler_stats"))
+async def cmd_handler_stats(message: Message, user_is_admin: bool = False):
+    """Show handler latency percentiles with DB and Bot API time"""
+    if not user_is_admin:
+        await message.answer("❌ У вас нет прав администратора!")
+        return
+
+    from middlewares.latency import get_handler_stats
+
+    stats = get_handler_stats()
+    if not stats:
+        await message.answer("Пока нет данных.")
+        return
+
+    text = "⚡ <b>Время обработки</b>\n"
+    for item in stats[:15]:
+        duration = item['duration']
+        text += f"\n<b>{item['handler']}</b> ({duration['count']})\n"
+        text += f"p50 {duration['p50']:.2f}с, p95 {duration['p95']:.2f}с, p99 {duration['p99']:.2f}с, макс. {duration['max']:.2f}с\n"
+        text += f"БД: ср. {item['db']['avg']:.2f}с, API: ср. {item['api']['avg']:.2f}с\n"
+
+    await message.answer(text, parse_mode="HTML")
+
+
+@router.message(Command("cache_stats"))
+async def cmd_cache_stats(message: Message, user_is_admin: bool = False):
+    """Show size, hit ratio and evictions of in-process caches"""
+    if not user_is_admin:
+        await message.answer("❌ У вас нет прав администратора!")
+        return
+
+    from cache import get_cache_stats
+
+    text = "🗄 <b>Кэши</b>\n"
+    for item in get_cache_stats():
+        text += f"\n<b>{item['name']}</b>: {item['entries']}/{item['maxsize']}, попаданий {item['hit_ratio']:.0%}\n"
+        text += f"Вытеснено: по размеру {int(item['evicted_size'])}, по времени {int(item['evicted_expired'])}\n"
+
+    await message.answer(text, parse_mode="HTML")
+
+
 @router.message(F.text == "📜 История")
-async def show_history(message: Message):
+async def show_history(message: Message, user_is_admin: bool = False):
     """Show history and statistics"""
-    if not await is_admin(message.from_user.id):
+    if not user_is_admin:
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -161,9 +258,9 @@ async def show_history(message: Message):
 
 
 @router.callback_query(F.data.startswith("admin_mark_sold:"))
-async def admin_mark_sold(callback: CallbackQuery):
+async def admin_mark_sold(callback: CallbackQuery, user_is_admin: bool = False):
     """Admin marks lot as sold"""
-    if not await is_admin(callback.from_user.id):
+    if not user_is_admin:
         await callback.answer("У вас нет прав администратора!", show_alert=True)
         return
 
@@ -184,7 +281,7 @@ async def admin_mark_sold(callback: CallbackQuery):
 
     # Update channel message to show "SOLD"
     if lot.get('channel_message_id'):
-        from bot import bot
+        from loader import bot
         from utils import format_sold_message, get_photos_list
         import logging
 
@@ -229,9 +326,9 @@ async def admin_mark_sold(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("history:"))
-async def show_history_lots(callback: CallbackQuery):
+async def show_history_lots(callback: CallbackQuery, user_is_admin: bool = False):
     """Show lots history by status"""
-    if not await is_admin(callback.from_user.id):
+    if not user_is_admin:
         await callback.answer("У вас нет прав администратора!", show_alert=True)
         return
 
@@ -267,10 +364,14 @@ async def show_history_lots(callback: CallbackQuery):
         parse_mode="HTML"
     )
 
-    from bot import bot
+    from loader import bot
+
+    # Owners and winners of all lots in one query
+    user_ids = {lot['owner_id'] for lot in lots} | {lot['leader_id'] for lot in lots if lot.get('leader_id')}
+    users = await db.get_users(list(user_ids))
 
     for lot in lots:
-        owner = await db.get_user(lot['owner_id'])
+        owner = users.get(lot['owner_id'])
         owner_name = owner['name'] if owner else "Неизвестно"
 
         text = f"🆔 <b>Лот #{lot['id']}</b>\n"
@@ -295,7 +396,7 @@ async def show_history_lots(callback: CallbackQuery):
 
         # Winner info if finished
         if lot['status'] == 'finished' and lot.get('leader_id'):
-            winner = await db.get_user(lot['leader_id'])
+            winner = users.get(lot['leader_id'])
             if winner:
                 text += f"🏆 Победитель: {winner['name']}\n"
 
@@ -335,9 +436,9 @@ async def show_history_lots(callback: CallbackQuery):
 
 
 @router.message(F.text == "🔔 Модерация")
-async def show_moderation(message: Message):
+async def show_moderation(message: Message, user_is_admin: bool = False):
     """Show pending lots for moderation"""
-    if not await is_admin(message.from_user.id):
+    if not user_is_admin:
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -359,11 +460,13 @@ async def show_moderation(message: Message):
     )
 
     # Send each lot for moderation
-    from bot import bot
+    from loader import bot
     from utils import create_media_group
 
+    owners = await db.get_users(list({lot['owner_id'] for lot in pending_lots}))
+
     for lot in pending_lots:
-        owner = await db.get_user(lot['owner_id'])
+        owner = owners.get(lot['owner_id']) or {'name': "Неизвестно"}
         owner_username = f"@{owner['username']}" if owner.get('username') else "нет username"
 
         caption = f"🔔 <b>Новый лот на модерацию</b>\n\n"
@@ -405,9 +508,9 @@ async def show_moderation(message: Message):
 
 
 @router.callback_query(F.data.startswith("moderate:"))
-async def handle_moderation(callback: CallbackQuery):
+async def handle_moderation(callback: CallbackQuery, user_is_admin: bool = False):
     """Handle lot moderation"""
-    if not await is_admin(callback.from_user.id):
+    if not user_is_admin:
         await callback.answer("У вас нет прав администратора!", show_alert=True)
         return
 
@@ -442,7 +545,7 @@ async def handle_moderation(callback: CallbackQuery):
             )
 
         # Send payment request to owner
-        from bot import bot
+        from loader import bot
 
         payment_text = (
             f"🎉 <b>Отличная новость!</b>\n\n"
@@ -483,9 +586,9 @@ async def handle_moderation(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("confirm_reject:"))
-async def confirm_rejection(callback: CallbackQuery, state: FSMContext):
+async def confirm_rejection(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Confirm lot rejection and ask for reason"""
-    if not await is_admin(callback.from_user.id):
+    if not user_is_admin:
         await callback.answer("У вас нет прав администратора!", show_alert=True)
         return
 
@@ -510,9 +613,9 @@ async def confirm_rejection(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("cancel_reject:"))
-async def cancel_rejection(callback: CallbackQuery, state: FSMContext):
+async def cancel_rejection(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Cancel lot rejection"""
-    if not await is_admin(callback.from_user.id):
+    if not user_is_admin:
         await callback.answer("У вас нет прав администратора!", show_alert=True)
         return
 
@@ -546,9 +649,9 @@ async def cancel_rejection(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("reject_reason:"))
-async def process_rejection_reason(callback: CallbackQuery, state: FSMContext):
+async def process_rejection_reason(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Process rejection reason selection"""
-    if not await is_admin(callback.from_user.id):
+    if not user_is_admin:
         await callback.answer("У вас нет прав администратора!", show_alert=True)
         return
 
@@ -592,7 +695,7 @@ async def process_rejection_reason(callback: CallbackQuery, state: FSMContext):
 
 async def reject_lot_with_reason(lot_id: int, reason: str, callback: CallbackQuery, state: FSMContext):
     """Reject lot with specified reason"""
-    from bot import bot
+    from loader import bot
 
     lot = await db.get_lot(lot_id)
     if not lot:
@@ -639,9 +742,9 @@ async def reject_lot_with_reason(lot_id: int, reason: str, callback: CallbackQue
 
 
 @router.message(AdminModeration.waiting_for_rejection_reason, F.text)
-async def process_custom_rejection_reason(message: Message, state: FSMContext):
+async def process_custom_rejection_reason(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process custom rejection reason from admin"""
-    if not await is_admin(message.from_user.id):
+    if not user_is_admin:
         return
 
     data = await state.get_data()
@@ -667,9 +770,9 @@ async def process_custom_rejection_reason(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("verify_payment:"))
-async def handle_payment_verification(callback: CallbackQuery, state: FSMContext):
+async def handle_payment_verification(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Handle payment verification - publish or reject"""
-    if not await is_admin(callback.from_user.id):
+    if not user_is_admin:
         await callback.answer("❌ У вас нет прав администратора!", show_alert=True)
         return
 
@@ -696,7 +799,7 @@ async def handle_payment_verification(callback: CallbackQuery, state: FSMContext
                 return
 
         # Publish to channel
-        from bot import bot, bot_username
+        from loader import bot, bot_username
 
         # Add lot type indicator to caption
         lot_type_label = "🔥 Аукцион" if lot.get('lot_type') == 'auction' else "💐 Букет на продажу"
@@ -815,7 +918,7 @@ async def handle_payment_verification(callback: CallbackQuery, state: FSMContext
                 return
 
         # Reject payment - notify user
-        from bot import bot
+        from loader import bot
 
         try:
             await callback.message.delete()
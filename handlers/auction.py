@@ -1,24 +1,49 @@
+from datetime import datetime
+from typing import Optional
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
-from datetime import datetime
+from aiogram.fsm.storage.base import StorageKey
 import logging
 
+from bidding import bid_book
 from database import db
+from outbox import outbox, pack_message
 from keyboards import get_bid_confirmation_keyboard, get_main_menu, get_cancel_keyboard, get_outbid_keyboard, get_mark_sold_keyboard
 from states import Bidding
-from utils import format_lot_message, validate_bid, calculate_end_time, format_price
+from utils import MIN_BID_STEP, format_lot_message, validate_bid, format_price
 import config
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Dictionary to track users waiting to enter bids: {user_id: lot_id}
-awaiting_bids = {}
+
+def get_bid_context(state: FSMContext, user_id: int) -> FSMContext:
+    """FSM context tracking which lot the user is entering a bid for"""
+    # Own destiny in the user's private chat: doesn't clash with lot creation states
+    # and works for callbacks coming from the channel
+    key = StorageKey(bot_id=state.key.bot_id, chat_id=user_id, user_id=user_id, destiny="awaiting_bid")
+    return FSMContext(storage=state.storage, key=key)
+
+
+async def get_awaiting_bid(state: FSMContext, user_id: int):
+    """Lot ID the user is entering a bid for, or None"""
+    data = await get_bid_context(state, user_id).get_data()
+    return data.get('lot_id')
+
+
+async def set_awaiting_bid(state: FSMContext, user_id: int, lot_id: int):
+    """Wait for the user to enter a bid amount for the lot"""
+    await get_bid_context(state, user_id).set_data({'lot_id': lot_id})
+
+
+async def clear_awaiting_bid(state: FSMContext, user_id: int):
+    """Stop waiting for a bid amount"""
+    await get_bid_context(state, user_id).clear()
 
 
 @router.callback_query(F.data.startswith("contact_seller:"))
-async def handle_contact_seller(callback: CallbackQuery, state: FSMContext):
+async def handle_contact_seller(callback: CallbackQuery, state: FSMContext, db_user: Optional[dict] = None):
     """Handle contact seller request for fixed price items"""
     lot_id = int(callback.data.split(":")[1])
 
@@ -36,11 +61,12 @@ async def handle_contact_seller(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Это не букет на продажу!", show_alert=True)
         return
 
-    from bot import bot
+    from loader import bot
 
     # Get seller and buyer info
     seller = await db.get_user(lot['owner_id'])
-    buyer = await db.get_user(callback.from_user.id)
+    # Loaded by SessionMiddleware; deep links right after registration come without it
+    buyer = db_user or await db.get_user(callback.from_user.id)
 
     if not seller or not buyer:
         await callback.answer("Ошибка получения данных пользователя!", show_alert=True)
@@ -110,8 +136,8 @@ async def handle_participate(callback: CallbackQuery, state: FSMContext):
         return
 
     # Check if user is already bidding on another lot
-    if callback.from_user.id in awaiting_bids:
-        previous_lot_id = awaiting_bids[callback.from_user.id]
+    previous_lot_id = await get_awaiting_bid(state, callback.from_user.id)
+    if previous_lot_id:
         if previous_lot_id != lot_id:
             logger.info(f"⚠️ User {callback.from_user.id} switching from lot {previous_lot_id} to lot {lot_id}")
             # Will be overwritten below
@@ -121,7 +147,6 @@ async def handle_participate(callback: CallbackQuery, state: FSMContext):
     bid_count = len(set([bid['user_id'] for bid in bids]))  # Unique participants
 
     current_price = lot.get('current_price') or lot['start_price']
-    MIN_BID_STEP = 500
 
     # Calculate minimum bid
     if lot.get('current_price') and lot['current_price'] > lot['start_price']:
@@ -142,35 +167,18 @@ async def handle_participate(callback: CallbackQuery, state: FSMContext):
     text += f"\n📋 <b>Участвуя в аукционе, вы </b><a href='https://telegra.ph/Re-Bloom---Term-of-Use-12-06'>соглашаетесь с правилами</a>\n"
     text += f"\n💬 <b>Напишите сумму вашей ставки:</b>"
 
-    # Send photo(s) with lot info to user (private)
-    from bot import bot
-    from utils import get_photos_list, create_media_group
-
-    photos = get_photos_list(lot['photos'])
+    # Send photo(s) with lot info to user (private), copied from the channel when published
+    from loader import bot
+    from utils import send_lot_media
 
     try:
-        if len(photos) == 0:
-            # No photos
+        caption_sent = await send_lot_media(callback.from_user.id, lot, text)
+        if not caption_sent:
             await bot.send_message(
                 chat_id=callback.from_user.id,
                 text=text,
                 parse_mode="HTML"
             )
-        elif len(photos) == 1:
-            # Single photo - send photo with caption
-            await bot.send_photo(
-                chat_id=callback.from_user.id,
-                photo=photos[0],
-                caption=text,
-                parse_mode="HTML"
-            )
-        else:
-            # Multiple photos - send as media group
-            media = create_media_group(photos, text)
-            await bot.send_media_group(
-                chat_id=callback.from_user.id,
-                media=media
-            )
     except Exception as e:
         # If can't send photo, attempt to reply in channel or fallback
         logger.error(f"Failed to send photos or DM: {e}")
@@ -178,7 +186,7 @@ async def handle_participate(callback: CallbackQuery, state: FSMContext):
         return
 
     # Mark user as waiting for bid input
-    awaiting_bids[callback.from_user.id] = lot_id
+    await set_awaiting_bid(state, callback.from_user.id, lot_id)
 
     logger.info(f"📍 Sent bid request to user {callback.from_user.id} for lot {lot_id}")
     await callback.answer()
@@ -187,12 +195,13 @@ async def handle_participate(callback: CallbackQuery, state: FSMContext):
 # Handle text messages that might be bids
 # This handler must be registered BEFORE menu.py handlers!
 @router.message(F.text)
-async def process_bid(message: Message, state: FSMContext):
+async def process_bid(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process bid amount from user if they're waiting to enter a bid"""
     # Check if user is waiting to enter a bid FIRST
-    if message.from_user.id not in awaiting_bids:
+    lot_id = await get_awaiting_bid(state, message.from_user.id)
+    if not lot_id:
         # Not waiting for bid - let other handlers process this
-        logger.debug(f"🔄 process_bid: User {message.from_user.id} not in awaiting_bids, skipping text: '{message.text}'")
+        logger.debug(f"🔄 process_bid: User {message.from_user.id} is not entering a bid, skipping text: '{message.text}'")
         return
 
     # Ignore commands (start with /)
@@ -205,15 +214,12 @@ async def process_bid(message: Message, state: FSMContext):
     if any(keyword in message.text for keyword in menu_keywords):
         return
 
-    lot_id = awaiting_bids[message.from_user.id]
-
     logger.info(f"🎯 process_bid HANDLER CALLED. User: {message.from_user.id}, Lot: {lot_id}, Text: '{message.text}'")
 
     # Handle cancel
     if message.text.strip().lower() in ["отмена", "cancel", "❌ отмена"]:
-        del awaiting_bids[message.from_user.id]
-        from utils import get_user_menu
-        menu = await get_user_menu(message.from_user.id)
+        await clear_awaiting_bid(state, message.from_user.id)
+        menu = get_main_menu(is_admin=user_is_admin)
         await message.answer("❌ Отменено.", reply_markup=menu)
         return
 
@@ -230,12 +236,11 @@ async def process_bid(message: Message, state: FSMContext):
         )
         return
 
-    lot = await db.get_lot(lot_id)
+    lot = await bid_book.get_lot(lot_id)
     if not lot:
-        # Remove from awaiting_bids
-        del awaiting_bids[message.from_user.id]
-        from utils import get_user_menu
-        menu = await get_user_menu(message.from_user.id)
+        # Stop waiting for bid
+        await clear_awaiting_bid(state, message.from_user.id)
+        menu = get_main_menu(is_admin=user_is_admin)
         await message.answer("Лот не найден! Возможно, аукцион завершён.", reply_markup=menu)
         return
 
@@ -254,6 +259,8 @@ async def process_bid(message: Message, state: FSMContext):
         f"<b>Подтверждение ставки</b>\n\n"
         f"💰 Ваша ставка: {format_price(amount_int)} сум\n"
         f"📦 Лот: {lot['description']}\n\n"
+        f"🤖 <i>Автоставка: бот сам перебьёт других участников с шагом {format_price(MIN_BID_STEP)} сум, "
+        f"но не дороже этой суммы.</i>\n\n"
         f"<b>Подтвердить ставку?</b>",
         parse_mode="HTML",
         reply_markup=get_bid_confirmation_keyboard(lot_id, amount_int)
@@ -261,7 +268,7 @@ async def process_bid(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("confirm_bid:"))
-async def confirm_bid(callback: CallbackQuery, state: FSMContext):
+async def confirm_bid(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Confirm bid — data contains lot_id and amount: confirm_bid:<lot_id>:<amount>"""
     parts = callback.data.split(":")
     if len(parts) < 3:
@@ -275,132 +282,189 @@ async def confirm_bid(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Некорректные данные.", show_alert=True)
         return
 
-    lot = await db.get_lot(lot_id)
-    if not lot:
+    # Validation, proxy answers and auction start come from the lot's bidding actor,
+    # the outbid notifications are stored in the same transaction as the bids
+    result = await bid_book.place_bid(
+        lot_id, callback.from_user.id, amount, outbid_notifications(lot_id, callback.from_user.id)
+    )
+    if not result or not result['lot']:
         await callback.message.edit_text("Лот не найден или завершён.")
         await callback.answer()
         return
 
-    # Re-validate in case someone else bid
-    current_price = lot.get('current_price') or lot['start_price']
-    is_valid, error_msg = validate_bid(amount, lot['start_price'], current_price)
-    if not is_valid:
-        await callback.message.edit_text(f"❌ {error_msg}", parse_mode="HTML")
+    if not result['accepted']:
+        await callback.message.edit_text(result['error'], parse_mode="HTML")
         await callback.answer()
         return
 
-    # Check if this is the first bid (auction not started yet)
-    auction_just_started = not lot.get('auction_started')
-
-    # Save bid
-    previous_leader_id = lot.get('leader_id')
+    lot = result['lot']
+    auction_just_started = result['auction_started']
+    await start_auction_if_needed(result)
 
-    await db.add_bid(lot_id, callback.from_user.id, amount)
+    # Prepare confirmation message
+    confirmation_msg = "✅ <b>Ваша ставка принята!</b>\n\n"
+    confirmation_msg += f"💰 Сумма: {format_price(amount)} сум\n"
+    if lot['leader_id'] == callback.from_user.id:
+        confirmation_msg += "🥇 Вы — текущий лидер аукциона!"
+    else:
+        # A proxy bid with a higher maximum answered right away
+        confirmation_msg += "⚠️ Автоставка другого участника сразу перебила её.\n"
+        confirmation_msg += f"🔥 Текущая ставка: {format_price(lot['current_price'])} сум"
 
-    # If this is the first bid, start the auction timer
     if auction_just_started:
-        end_time = calculate_end_time()
-        await db.start_auction(
-            lot_id=lot_id,
-            start_time=datetime.now().isoformat(),
-            end_time=end_time.isoformat()
-        )
+        confirmation_msg += "\n\n⏰ <b>Торги начались!</b>\nДо завершения: 2 часа"
 
-        # Schedule auction completion and updates
-        from scheduler import schedule_auction_completion
-        await schedule_auction_completion(lot_id, end_time)
+    await callback.message.edit_text(confirmation_msg, parse_mode="HTML")
+    await finish_bidding(callback, state, user_is_admin)
 
-        logger.info(f"🚀 Auction {lot_id} started! Ends at {end_time}")
+    # Update channel message with new bid info (latest state, later bids may have come in meanwhile)
+    await update_channel_after_bid(await bid_book.get_lot(lot_id) or lot, auction_just_started)
+    await callback.answer()
 
-    # Refresh lot data after bid
-    lot = await db.get_lot(lot_id)
 
-    # Prepare confirmation message
-    confirmation_msg = f"✅ <b>Ваша ставка принята!</b>\n\n"
-    confirmation_msg += f"💰 Сумма: {format_price(amount)} сум\n"
-    confirmation_msg += f"🥇 Вы — текущий лидер аукциона!"
+@router.callback_query(F.data.startswith("proxy_bid:"))
+async def confirm_proxy_bid(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
+    """Set a proxy bid — the bot bids for the user up to the amount: proxy_bid:<lot_id>:<max_amount>"""
+    parts = callback.data.split(":")
+    if len(parts) < 3:
+        await callback.answer()
+        return
 
-    if auction_just_started:
-        confirmation_msg += f"\n\n⏰ <b>Торги начались!</b>\nДо завершения: 2 часа"
+    lot_id = int(parts[1])
+    try:
+        max_amount = float(parts[2])
+    except Exception:
+        await callback.answer("Некорректные данные.", show_alert=True)
+        return
+
+    # Competing proxies are settled by the actor at once and stored with the proxy in one batch
+    result = await bid_book.set_proxy(
+        lot_id, callback.from_user.id, max_amount, outbid_notifications(lot_id, callback.from_user.id)
+    )
+    if not result or not result['lot']:
+        await callback.message.edit_text("Лот не найден или завершён.")
+        await callback.answer()
+        return
+
+    if not result['accepted']:
+        await callback.message.edit_text(result['error'], parse_mode="HTML")
+        await callback.answer()
+        return
+
+    lot = result['lot']
+    await start_auction_if_needed(result)
+
+    text = "🤖 <b>Автоставка установлена!</b>\n\n"
+    text += f"💰 Ваш максимум: {format_price(max_amount)} сум\n"
+    text += f"🔥 Текущая ставка: {format_price(lot['current_price'])} сум\n\n"
+    if lot['leader_id'] == callback.from_user.id:
+        text += (f"🥇 Вы — текущий лидер аукциона! Если вас перебьют, бот сам поднимет ставку "
+                 f"на {format_price(MIN_BID_STEP)} сум, пока не дойдёт до вашего максимума.")
+    else:
+        text += "⚠️ У другого участника максимум выше — ваша автоставка уже перебита."
+
+    if result['auction_started']:
+        text += "\n\n⏰ <b>Торги начались!</b>\nДо завершения: 2 часа"
+
+    await callback.message.edit_text(text, parse_mode="HTML")
+    await finish_bidding(callback, state, user_is_admin)
+
+    # Raising one's own maximum doesn't change the price
+    if lot['current_price'] != result['previous_price']:
+        await update_channel_after_bid(await bid_book.get_lot(lot_id) or lot, result['auction_started'])
+    await callback.answer()
+
+
+def outbid_notifications(lot_id: int, user_id: int):
+    """Outbid notification builder for bid_book; the user who acted sees the outcome in the reply instead"""
+    def build(outbid_ids, lot):
+        return [pack_message(
+            chat_id=outbid_id,
+            text=f"⚠️ <b>Вашу ставку перебили!</b>\n\n"
+                 f"📦 Лот: {lot['description']}\n"
+                 f"💰 Новая ставка: {format_price(lot['current_price'])} сум",
+            parse_mode="HTML",
+            reply_markup=get_outbid_keyboard(lot_id)
+        ) for outbid_id in outbid_ids if outbid_id != user_id]
+    return build
+
+
+async def start_auction_if_needed(result):
+    """Deliver the stored outbid notifications and schedule completion if the bid started the auction"""
+    outbox.wake()
+    if not result['auction_started']:
+        return
+
+    lot = result['lot']
+    end_time = datetime.fromisoformat(lot['end_time'])
+    from scheduler import schedule_auction_completion
+    await schedule_auction_completion(lot['id'], end_time)
+
+    logger.info(f"🚀 Auction {lot['id']} started! Ends at {end_time}")
 
-    await callback.message.edit_text(confirmation_msg, parse_mode="HTML")
 
-    # Remove user from awaiting_bids (bid completed)
-    if callback.from_user.id in awaiting_bids:
-        del awaiting_bids[callback.from_user.id]
+async def finish_bidding(callback: CallbackQuery, state: FSMContext, user_is_admin: bool):
+    """Stop waiting for a bid amount and bring the main menu back"""
+    await clear_awaiting_bid(state, callback.from_user.id)
 
-    # Restore main menu after bid confirmation
-    from bot import bot
-    from utils import get_user_menu
-    menu = await get_user_menu(callback.from_user.id)
+    from loader import bot
+    menu = get_main_menu(is_admin=user_is_admin)
     await bot.send_message(
         chat_id=callback.from_user.id,
         text="Используйте меню ниже для навигации:",
         reply_markup=menu
     )
 
-    # Update channel message with new bid info
-    if lot.get('channel_message_id'):
-        from bot import bot
-        from bot import bot_username
-        from utils import format_lot_message, format_auction_status, get_photos_list
-        from keyboards import get_participate_keyboard
 
-        try:
-            photos = get_photos_list(lot['photos'])
+async def update_channel_after_bid(lot, auction_just_started: bool):
+    """Show the new price (and the timer, once started) in the lot's channel post"""
+    if not lot.get('channel_message_id'):
+        return
 
-            if len(photos) == 1:
-                # Single photo - edit caption
-                updated_text = format_lot_message(lot) + format_auction_status(lot)
-                await bot.edit_message_caption(
+    from loader import bot
+    from loader import bot_username
+    from utils import format_auction_status, get_photos_list
+    from keyboards import get_participate_keyboard
+
+    lot_id = lot['id']
+    try:
+        photos = get_photos_list(lot['photos'])
+
+        if len(photos) == 1:
+            # Single photo - edit caption
+            updated_text = format_lot_message(lot) + format_auction_status(lot)
+            await bot.edit_message_caption(
+                chat_id=config.CHANNEL_ID,
+                message_id=lot['channel_message_id'],
+                caption=updated_text,
+                parse_mode="HTML",
+                reply_markup=get_participate_keyboard(lot_id, bot_username)
+            )
+
+            if auction_just_started:
+                logger.info(f"📢 Channel message updated - auction {lot_id} timer is now visible!")
+            else:
+                logger.info(f"📢 Channel message updated - new bid {lot['current_price']} for auction {lot_id}")
+        else:
+            # Media group - edit button message with status
+            if lot.get('channel_button_message_id'):
+                button_text = "👇 Нажмите чтобы участвовать в аукционе\n\n"
+                button_text += format_auction_status(lot)
+
+                await bot.edit_message_text(
                     chat_id=config.CHANNEL_ID,
-                    message_id=lot['channel_message_id'],
-                    caption=updated_text,
+                    message_id=lot['channel_button_message_id'],
+                    text=button_text,
                     parse_mode="HTML",
                     reply_markup=get_participate_keyboard(lot_id, bot_username)
                 )
 
                 if auction_just_started:
-                    logger.info(f"📢 Channel message updated - auction {lot_id} timer is now visible!")
+                    logger.info(f"📢 Button message updated - auction {lot_id} timer is now visible!")
                 else:
-                    logger.info(f"📢 Channel message updated - new bid {amount} for auction {lot_id}")
-            else:
-                # Media group - edit button message with status
-                if lot.get('channel_button_message_id'):
-                    button_text = "👇 Нажмите чтобы участвовать в аукционе\n\n"
-                    button_text += format_auction_status(lot)
-
-                    await bot.edit_message_text(
-                        chat_id=config.CHANNEL_ID,
-                        message_id=lot['channel_button_message_id'],
-                        text=button_text,
-                        parse_mode="HTML",
-                        reply_markup=get_participate_keyboard(lot_id, bot_username)
-                    )
-
-                    if auction_just_started:
-                        logger.info(f"📢 Button message updated - auction {lot_id} timer is now visible!")
-                    else:
-                        logger.info(f"📢 Button message updated - new bid {amount} for auction {lot_id}")
-        except Exception as e:
-            logger.error(f"Failed to update channel message after bid: {e}")
-
-    # Notify previous leader
-    if previous_leader_id and previous_leader_id != callback.from_user.id:
-        from bot import bot
-        try:
-            await bot.send_message(
-                chat_id=previous_leader_id,
-                text=f"⚠️ <b>Вашу ставку перебили!</b>\n\n"
-                     f"📦 Лот: {lot['description']}\n"
-                     f"💰 Новая ставка: {format_price(amount)} сум",
-                parse_mode="HTML",
-                reply_markup=get_outbid_keyboard(lot_id)
-            )
-        except Exception:
-            pass
-
-    await callback.answer()
+                    logger.info(f"📢 Button message updated - new bid {lot['current_price']} for auction {lot_id}")
+    except Exception as e:
+        logger.error(f"Failed to update channel message after bid: {e}")
 
 
 @router.callback_query(F.data.startswith("change_bid:"))
@@ -423,13 +487,12 @@ async def change_bid(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("stop_participation:"))
-async def stop_participation(callback: CallbackQuery, state: FSMContext):
+async def stop_participation(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Handle stop participation button - user wants to cancel bidding"""
     lot_id = int(callback.data.split(":")[1])
 
-    # Remove user from awaiting_bids
-    if callback.from_user.id in awaiting_bids:
-        del awaiting_bids[callback.from_user.id]
+    # Stop waiting for bid
+    await clear_awaiting_bid(state, callback.from_user.id)
 
     # Edit message
     await callback.message.edit_text(
@@ -439,9 +502,8 @@ async def stop_participation(callback: CallbackQuery, state: FSMContext):
     )
 
     # Restore main menu
-    from bot import bot
-    from utils import get_user_menu
-    menu = await get_user_menu(callback.from_user.id)
+    from loader import bot
+    menu = get_main_menu(is_admin=user_is_admin)
     await bot.send_message(
         chat_id=callback.from_user.id,
         text="Используйте меню ниже для навигации:",
@@ -487,7 +549,7 @@ async def handle_mark_sold(callback: CallbackQuery, state: FSMContext):
 
     # Update channel message to show "SOLD"
     if lot.get('channel_message_id'):
-        from bot import bot
+        from loader import bot
         from utils import format_sold_message, get_photos_list
 
         try:
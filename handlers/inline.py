@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+from aiogram import Router
+from aiogram.types import InlineQuery, InlineQueryResultCachedPhoto
+
+from database import db
+from keyboards import get_participate_keyboard, get_buy_keyboard
+from utils import get_photos_list, render_lot_caption
+import config
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+class ActiveLotIndex:
+    """In-memory snapshot of active and approved lots for inline queries"""
+
+    def __init__(self, ttl: float = config.INLINE_INDEX_TTL_SECONDS):
+        self.ttl = ttl
+        # [(search text, lot)], newest first
+        self._entries: List[tuple] = []
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _refresh(self):
+        """Reload lots from the database once the snapshot is older than ttl"""
+        if time.monotonic() - self._loaded_at < self.ttl:
+            return
+
+        async with self._lock:
+            # Another query may have refreshed it while we waited
+            if time.monotonic() - self._loaded_at < self.ttl:
+                return
+
+            lots = await db.get_all_active_lots()
+            self._entries = [
+                (f"{lot['description']} {lot['city']} {lot['size']}".lower(), lot)
+                for lot in lots
+                if get_photos_list(lot['photos'])
+            ]
+            self._loaded_at = time.monotonic()
+
+    async def search(self, query: str) -> List[Dict[str, Any]]:
+        """Lots whose description, city or size contain every word of the query"""
+        await self._refresh()
+        words = query.lower().split()
+        if not words:
+            return [lot for _, lot in self._entries]
+        return [lot for text, lot in self._entries if all(word in text for word in words)]
+
+
+# Global lot index
+lot_index = ActiveLotIndex()
+
+
+def build_inline_result(lot: Dict[str, Any]) -> InlineQueryResultCachedPhoto:
+    """Inline result for a lot: first photo, caption and deep link keyboard"""
+    from loader import bot_username
+
+    if lot['lot_type'] == 'auction':
+        keyboard = get_participate_keyboard(lot['id'], bot_username)
+    else:
+        keyboard = get_buy_keyboard(lot['id'], bot_username)
+
+    return InlineQueryResultCachedPhoto(
+        id=str(lot['id']),
+        photo_file_id=get_photos_list(lot['photos'])[0],
+        title=lot['description'][:64],
+        caption=render_lot_caption(lot),
+        parse_mode="HTML",
+        reply_markup=keyboard
+    )
+
+
+@router.inline_query()
+async def handle_inline_query(inline_query: InlineQuery):
+    """Search active lots from any chat: @bot query"""
+    lots = await lot_index.search(inline_query.query)
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    page = lots[offset:offset + config.INLINE_PAGE_SIZE]
+    next_offset = str(offset + config.INLINE_PAGE_SIZE) if offset + config.INLINE_PAGE_SIZE < len(lots) else ""
+
+    await inline_query.answer(
+        results=[build_inline_result(lot) for lot in page],
+        cache_time=config.INLINE_CACHE_SECONDS,
+        is_personal=False,
+        next_offset=next_offset
+    )
@@ -1,21 +1,26 @@
+from typing import List, Optional
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from database import db
-from keyboards import get_draft_edit_keyboard, get_draft_preview_keyboard, get_main_menu, get_cancel_keyboard, get_moderation_keyboard, get_size_keyboard, get_wear_keyboard, get_delete_confirmation_keyboard, get_city_keyboard, get_participate_keyboard, get_buy_keyboard
+from keyboards import get_draft_edit_keyboard, get_draft_preview_keyboard, get_main_menu, get_cancel_keyboard, get_moderation_keyboard, get_size_keyboard, get_wear_keyboard, get_delete_confirmation_keyboard, get_city_keyboard, get_participate_keyboard, get_buy_keyboard, get_photos_keyboard
+from middlewares import AlbumMiddleware
 from states import LotCreation
 from utils import format_lot_message, get_photos_list, photos_to_string, create_media_group, get_user_menu, format_price
 import config
 
 router = Router()
+# Photos of one album are handled together, in message order
+router.message.middleware(AlbumMiddleware())
 
 
 @router.message(LotCreation.waiting_for_photos, F.photo)
-async def process_photos(message: Message, state: FSMContext):
+async def process_photos(message: Message, state: FSMContext, album: Optional[List[Message]] = None):
     """Collect photos silently; confirm once when user finishes with 'Готово'"""
     data = await state.get_data()
     photos = data.get('photos', [])
+    had_photos = bool(photos)
 
     MAX_PHOTOS = 10
 
@@ -24,12 +29,14 @@ async def process_photos(message: Message, state: FSMContext):
         await state.set_state(LotCreation.waiting_for_photos)
         return
 
-    # Add new photo and stay on this step without confirmations
-    photos.append(message.photo[-1].file_id)
+    # Add new photo(s) and stay on this step without confirmations
+    for photo_message in album or [message]:
+        if photo_message.photo and len(photos) < MAX_PHOTOS:
+            photos.append(photo_message.photo[-1].file_id)
     await state.update_data(photos=photos)
 
-    # Send confirmation with "Done" button after first photo
-    if len(photos) == 1:
+    # Send confirmation with "Done" button after first photo (or album)
+    if not had_photos:
         await message.answer(
             f"✅ Фото загружено: {len(photos)}/10\n\n"
             "Отправьте еще фото или нажмите кнопку 'Готово' для продолжения.",
@@ -40,21 +47,21 @@ async def process_photos(message: Message, state: FSMContext):
 
 
 @router.message(LotCreation.waiting_for_photos, F.text)
-async def cancel_photos(message: Message, state: FSMContext):
+async def cancel_photos(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Handle controls during photo upload"""
     text = message.text.strip().lower()
 
     # Cancel
     if text in ["❌ отмена", "отмена", "cancel"]:
         await state.clear()
-        menu = await get_user_menu(message.from_user.id)
+        menu = await get_user_menu(message.from_user.id, user_is_admin)
         await message.answer("❌ Создание лота отменено.", reply_markup=menu)
         return
 
     # Back (on first step -> back to menu)
     if text in ["◀️ назад", "назад", "back"]:
         await state.clear()
-        menu = await get_user_menu(message.from_user.id)
+        menu = await get_user_menu(message.from_user.id, user_is_admin)
         await message.answer("◀️ Возврат в меню.", reply_markup=menu)
         return
 
@@ -93,14 +100,14 @@ async def invalid_photos(message: Message):
 
 
 @router.message(LotCreation.waiting_for_description, F.text)
-async def process_description(message: Message, state: FSMContext):
+async def process_description(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process lot description"""
     text = message.text.strip()
 
     # Cancel
     if text.lower() in ["❌ отмена", "отмена", "cancel"]:
         await state.clear()
-        menu = await get_user_menu(message.from_user.id)
+        menu = await get_user_menu(message.from_user.id, user_is_admin)
         await message.answer("❌ Создание лота отменено.", reply_markup=menu)
         return
 
@@ -165,14 +172,14 @@ async def process_description(message: Message, state: FSMContext):
 
 
 @router.message(LotCreation.waiting_for_city, F.text)
-async def process_city(message: Message, state: FSMContext):
+async def process_city(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process lot city"""
     text = message.text.strip()
 
     # Cancel
     if text.lower() in ["❌ отмена", "отмена", "cancel"]:
         await state.clear()
-        menu = await get_user_menu(message.from_user.id)
+        menu = await get_user_menu(message.from_user.id, user_is_admin)
         await message.answer("❌ Создание лота отменено.", reply_markup=menu)
         return
 
@@ -215,14 +222,14 @@ async def process_city(message: Message, state: FSMContext):
 
 
 @router.message(LotCreation.waiting_for_size, F.text)
-async def process_size(message: Message, state: FSMContext):
+async def process_size(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process lot size"""
     text = message.text.strip()
 
     # Cancel
     if text.lower() in ["❌ отмена", "отмена", "cancel"]:
         await state.clear()
-        menu = await get_user_menu(message.from_user.id)
+        menu = await get_user_menu(message.from_user.id, user_is_admin)
         await message.answer("❌ Создание лота отменено.", reply_markup=menu)
         return
 
@@ -258,14 +265,14 @@ async def process_size(message: Message, state: FSMContext):
 
 
 @router.message(LotCreation.waiting_for_wear, F.text)
-async def process_wear(message: Message, state: FSMContext):
+async def process_wear(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process lot wear"""
     text = message.text.strip()
 
     # Cancel
     if text.lower() in ["❌ отмена", "отмена", "cancel"]:
         await state.clear()
-        menu = await get_user_menu(message.from_user.id)
+        menu = await get_user_menu(message.from_user.id, user_is_admin)
         await message.answer("❌ Создание лота отменено.", reply_markup=menu)
         return
 
@@ -316,14 +323,14 @@ async def process_wear(message: Message, state: FSMContext):
 
 
 @router.message(LotCreation.waiting_for_price, F.text)
-async def process_price(message: Message, state: FSMContext):
+async def process_price(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process lot price and create draft"""
     text = message.text.strip()
 
     # Cancel
     if text.lower() in ["❌ отмена", "отмена", "cancel"]:
         await state.clear()
-        menu = await get_user_menu(message.from_user.id)
+        menu = await get_user_menu(message.from_user.id, user_is_admin)
         await message.answer("❌ Создание лота отменено.", reply_markup=menu)
         return
 
@@ -372,7 +379,7 @@ async def process_price(message: Message, state: FSMContext):
         await state.update_data(lot_id=lot_id)
 
         # Show draft with preview
-        await show_lot_draft(message, lot_id, state)
+        await show_lot_draft(message, lot_id, state, user_is_admin)
         await state.set_state(LotCreation.editing_draft)
 
     except ValueError:
@@ -382,14 +389,14 @@ async def process_price(message: Message, state: FSMContext):
         )
 
 
-async def show_lot_draft(message: Message, lot_id: int, state: FSMContext):
+async def show_lot_draft(message: Message, lot_id: int, state: FSMContext, user_is_admin: bool = False):
     """Show lot draft with edit buttons"""
     lot = await db.get_lot(lot_id)
 
     if not lot:
         await message.answer(
             "❌ Ошибка: лот не найден.",
-            reply_markup=await get_user_menu(message.from_user.id)
+            reply_markup=await get_user_menu(message.from_user.id, user_is_admin)
         )
         await state.clear()
         return
@@ -423,7 +430,7 @@ async def show_lot_draft(message: Message, lot_id: int, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("edit_draft:"))
-async def handle_draft_edit(callback: CallbackQuery, state: FSMContext):
+async def handle_draft_edit(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Handle draft editing"""
     parts = callback.data.split(":")
     action = parts[1]
@@ -444,16 +451,16 @@ async def handle_draft_edit(callback: CallbackQuery, state: FSMContext):
 
     elif action == "back":
         # Return to preview
-        await show_lot_draft(callback.message, lot_id, state)
+        await show_lot_draft(callback.message, lot_id, state, user_is_admin)
         await callback.answer()
         return
 
     elif action == "publish":
         # Send directly to moderation without payment
-        from bot import bot
+        from loader import bot
 
         # Notify user that lot is sent to moderation
-        menu = await get_user_menu(callback.from_user.id)
+        menu = await get_user_menu(callback.from_user.id, user_is_admin)
         await callback.message.answer(
             "✅ <b>Ваш лот отправлен на модерацию!</b>\n\n"
             "После проверки модератором:\n"
@@ -543,11 +550,13 @@ async def handle_draft_edit(callback: CallbackQuery, state: FSMContext):
 
 # Edit handlers
 @router.message(LotCreation.edit_photos, F.photo)
-async def edit_photos(message: Message, state: FSMContext):
+async def edit_photos(message: Message, state: FSMContext, album: Optional[List[Message]] = None):
     """Edit lot photos"""
     data = await state.get_data()
     photos = data.get('temp_photos', [])
-    photos.append(message.photo[-1].file_id)
+    for photo_message in album or [message]:
+        if photo_message.photo:
+            photos.append(photo_message.photo[-1].file_id)
 
     await state.update_data(temp_photos=photos)
     await message.answer(f"Фото добавлено ({len(photos)}). Отправьте еще или введите 'Готово'")
@@ -742,7 +751,7 @@ async def edit_wear(message: Message, state: FSMContext):
 
 # Payment screenshot handler - sends to admin for verification
 @router.message(F.photo)
-async def process_payment_screenshot(message: Message, state: FSMContext):
+async def process_payment_screenshot(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process payment screenshot and send to admin for verification"""
     # Check if user has an approved lot waiting for payment
     lots = await db.get_user_lots_by_status(message.from_user.id, 'approved_waiting_payment')
@@ -764,7 +773,7 @@ async def process_payment_screenshot(message: Message, state: FSMContext):
     await db.update_lot_status(lot_id, 'pending_payment_verification')
 
     # Notify user
-    menu = await get_user_menu(message.from_user.id)
+    menu = await get_user_menu(message.from_user.id, user_is_admin)
     await message.answer(
         "✅ <b>Чек получен!</b>\n\n"
         "Ваш чек отправлен на проверку администратору\n\n"
@@ -775,7 +784,7 @@ async def process_payment_screenshot(message: Message, state: FSMContext):
     )
 
     # Notify admins - send lot + payment screenshot
-    from bot import bot
+    from loader import bot
 
     admin_ids = await db.get_all_admin_ids()
 
@@ -817,7 +826,7 @@ async def process_payment_screenshot(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("confirm_delete:"))
-async def confirm_delete_lot(callback: CallbackQuery, state: FSMContext):
+async def confirm_delete_lot(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Confirm lot deletion"""
     lot_id = int(callback.data.split(":")[1])
 
@@ -828,13 +837,13 @@ async def confirm_delete_lot(callback: CallbackQuery, state: FSMContext):
     # Send message with main menu
     await callback.message.answer(
         "Возвращаемся в главное меню.",
-        reply_markup=await get_user_menu(callback.from_user.id)
+        reply_markup=await get_user_menu(callback.from_user.id, user_is_admin)
     )
     await state.clear()
 
 
 @router.callback_query(F.data.startswith("cancel_delete:"))
-async def cancel_delete_lot(callback: CallbackQuery, state: FSMContext):
+async def cancel_delete_lot(callback: CallbackQuery, state: FSMContext, user_is_admin: bool = False):
     """Cancel lot deletion"""
     lot_id = int(callback.data.split(":")[1])
 
@@ -850,7 +859,7 @@ async def cancel_delete_lot(callback: CallbackQuery, state: FSMContext):
         pass
 
     # Show draft again
-    await show_lot_draft(callback.message, lot_id, state)
+    await show_lot_draft(callback.message, lot_id, state, user_is_admin)
     await state.set_state(LotCreation.editing_draft)
 
 
@@ -1,5 +1,7 @@
+from typing import Optional
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
 import logging
 
@@ -11,9 +13,9 @@ router = Router()
 logger = logging.getLogger(__name__)
 
 
-async def check_registration(message: Message) -> bool:
-    """Check if user is registered"""
-    is_registered = await db.is_user_registered(message.from_user.id)
+async def check_registration(message: Message, db_user: Optional[dict]) -> bool:
+    """Check if user is registered (db_user comes from SessionMiddleware)"""
+    is_registered = db_user is not None
     if not is_registered:
         await message.answer(
             "Вы не зарегистрированы! Используйте /start для регистрации."
@@ -22,17 +24,17 @@ async def check_registration(message: Message) -> bool:
 
 
 @router.message(F.text == "🔥 Добавить товарный аукцион")
-async def create_auction(message: Message, state: FSMContext):
+async def create_auction(message: Message, state: FSMContext, db_user: Optional[dict] = None,
+                         user_is_admin: bool = False):
     """Start auction creation"""
-    if not await check_registration(message):
+    if not await check_registration(message, db_user):
         return
 
     # Check if user has unpaid lots
     unpaid_lots = await db.get_user_lots_by_status(message.from_user.id, 'approved_waiting_payment')
 
     if unpaid_lots:
-        from utils import get_user_menu
-        menu = await get_user_menu(message.from_user.id)
+        menu = get_main_menu(is_admin=user_is_admin)
         await message.answer(
             "⚠️ <b>У вас есть неоплаченный лот!</b>\n\n"
             "Прежде чем создавать новый лот, необходимо оплатить предыдущий.\n\n"
@@ -56,17 +58,17 @@ async def create_auction(message: Message, state: FSMContext):
 
 
 @router.message(F.text == "💐 Выставить букет по фиксированной цене")
-async def create_regular_sale(message: Message, state: FSMContext):
+async def create_regular_sale(message: Message, state: FSMContext, db_user: Optional[dict] = None,
+                              user_is_admin: bool = False):
     """Start regular sale creation"""
-    if not await check_registration(message):
+    if not await check_registration(message, db_user):
         return
 
     # Check if user has unpaid lots
     unpaid_lots = await db.get_user_lots_by_status(message.from_user.id, 'approved_waiting_payment')
 
     if unpaid_lots:
-        from utils import get_user_menu
-        menu = await get_user_menu(message.from_user.id)
+        menu = get_main_menu(is_admin=user_is_admin)
         await message.answer(
             "⚠️ <b>У вас есть неоплаченный лот!</b>\n\n"
             "Прежде чем создавать новый лот, необходимо оплатить предыдущий.\n\n"
@@ -90,20 +92,18 @@ async def create_regular_sale(message: Message, state: FSMContext):
 
 
 @router.message(F.text == "📋 Текущие аукционы")
-async def show_current_auctions(message: Message):
-    """Show all current auctions in bot"""
-    if not await check_registration(message):
+async def show_current_auctions(message: Message, db_user: Optional[dict] = None):
+    """Show current auctions as a carousel: one message, browsed with ◀️/▶️"""
+    if not await check_registration(message, db_user):
         return
 
-    from database import db
-    from utils import format_lot_message, get_photos_list, format_auction_status
-    from keyboards import get_participate_keyboard, get_buy_keyboard
-    from bot import bot
+    from utils import get_photos_list, render_lot_caption
+    from keyboards import get_carousel_keyboard
 
-    # Get all active and approved lots
-    lots = await db.get_all_active_lots()
+    # Newest lot first
+    lot = await db.get_active_lot_page()
 
-    if not lots:
+    if not lot:
         await message.answer(
             "📭 <b>Нет активных аукционов</b>\n\n"
             "На данный момент нет активных аукционов или товаров.\n"
@@ -112,56 +112,68 @@ async def show_current_auctions(message: Message):
         )
         return
 
-    await message.answer(
-        f"📋 <b>Текущие аукционы и товары: {len(lots)}</b>\n\n"
-        f"Отправляю их вам...",
-        parse_mode="HTML"
+    position, total = await db.get_active_lot_position(lot['id'])
+    photos = get_photos_list(lot['photos'])
+
+    await message.answer_photo(
+        photo=photos[0],
+        caption=render_lot_caption(lot),
+        parse_mode="HTML",
+        reply_markup=get_carousel_keyboard(lot, position, total)
     )
 
-    for lot in lots:
-        photos = get_photos_list(lot['photos'])
-
-        # Build caption
-        if lot['lot_type'] == 'auction':
-            caption = "🔥 <b>Аукцион</b>\n\n"
-        else:
-            caption = "💐 <b>Букет на продажу</b>\n\n"
-
-        caption += format_lot_message(lot)
-
-        if lot['lot_type'] == 'auction' and lot.get('auction_started'):
-            caption += format_auction_status(lot)
-
-        # Choose keyboard based on lot type
-        if lot['lot_type'] == 'auction':
-            keyboard = get_participate_keyboard(lot['id'])
-        else:
-            keyboard = get_buy_keyboard(lot['id'])
-
-        # Send lot
-        try:
-            if len(photos) == 1:
-                await bot.send_photo(
-                    chat_id=message.from_user.id,
-                    photo=photos[0],
-                    caption=caption,
-                    parse_mode="HTML",
-                    reply_markup=keyboard
-                )
-            else:
-                from utils import create_media_group
-                media = create_media_group(photos, caption)
-                await bot.send_media_group(
-                    chat_id=message.from_user.id,
-                    media=media
-                )
-                await bot.send_message(
-                    chat_id=message.from_user.id,
-                    text="👇 Нажмите чтобы участвовать" if lot['lot_type'] == 'auction' else "👇 Нажмите чтобы купить",
-                    reply_markup=keyboard
-                )
-        except Exception as e:
-            logger.error(f"Failed to send lot {lot['id']}: {e}")
+
+@router.callback_query(F.data.startswith("carousel:"))
+async def carousel_navigate(callback: CallbackQuery):
+    """Show previous/next lot in the carousel message"""
+    from utils import get_photos_list, render_lot_caption
+    from keyboards import get_carousel_keyboard
+
+    _, lot_id, direction = callback.data.split(":")
+    lot = await db.get_active_lot_page(int(lot_id), direction)
+
+    if not lot:
+        await callback.answer("Больше лотов нет")
+        return
+
+    position, total = await db.get_active_lot_position(lot['id'])
+    photos = get_photos_list(lot['photos'])
+
+    try:
+        await callback.message.edit_media(
+            media=InputMediaPhoto(media=photos[0], caption=render_lot_caption(lot), parse_mode="HTML"),
+            reply_markup=get_carousel_keyboard(lot, position, total)
+        )
+    except TelegramBadRequest as e:
+        # Double tap on the same button
+        if "message is not modified" not in str(e):
+            logger.error(f"Failed to show lot {lot['id']} in carousel: {e}")
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("carousel_photos:"))
+async def carousel_photos(callback: CallbackQuery):
+    """Send all photos of the lot shown in the carousel"""
+    from utils import send_lot_media, render_lot_caption
+
+    lot_id = int(callback.data.split(":")[1])
+    lot = await db.get_lot(lot_id)
+
+    if not lot or lot['status'] not in ['approved', 'active']:
+        await callback.answer("Лот больше недоступен!", show_alert=True)
+        return
+
+    try:
+        await send_lot_media(callback.from_user.id, lot, render_lot_caption(lot))
+    except Exception as e:
+        logger.error(f"Failed to send photos of lot {lot_id}: {e}")
+    await callback.answer()
+
+
+@router.callback_query(F.data == "carousel_noop")
+async def carousel_noop(callback: CallbackQuery):
+    """Position counter button does nothing"""
+    await callback.answer()
 
 
 # Debug handler is commented out to avoid conflicts with auction bid handler
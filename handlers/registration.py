@@ -1,12 +1,13 @@
+from typing import Optional
 from aiogram import Router, F
 from aiogram.filters import CommandStart
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 
 from database import db
+from middlewares.session import invalidate_session
 from keyboards import get_phone_keyboard, get_main_menu, get_admin_menu
 from states import Registration
-from utils import is_admin
 
 router = Router()
 
@@ -57,18 +58,17 @@ async def handle_deep_link(message: Message, param: str, state: FSMContext):
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, db_user: Optional[dict] = None,
+                    user_is_admin: bool = False):
     """Handle /start command"""
     # Extract deep link parameter if present
     args = message.text.split(maxsplit=1)
     deep_link_param = args[1] if len(args) > 1 else None
 
-    # Check if user is already registered
-    is_registered = await db.is_user_registered(message.from_user.id)
+    # Check if user is already registered (loaded by SessionMiddleware)
+    is_registered = db_user is not None
 
     if is_registered:
-        # Check if user is admin
-        user_is_admin = await is_admin(message.from_user.id)
         menu = get_admin_menu() if user_is_admin else get_main_menu(is_admin=user_is_admin)
 
         await message.answer(
@@ -94,7 +94,7 @@ async def cmd_start(message: Message, state: FSMContext):
 
 
 @router.message(Registration.waiting_for_phone, F.contact)
-async def process_phone(message: Message, state: FSMContext):
+async def process_phone(message: Message, state: FSMContext, user_is_admin: bool = False):
     """Process phone number from contact"""
     contact = message.contact
 
@@ -115,8 +115,9 @@ async def process_phone(message: Message, state: FSMContext):
     )
 
     if success:
-        # Check if user is admin
-        user_is_admin = await is_admin(message.from_user.id)
+        invalidate_session(message.from_user.id)
+
+        # Admin flag comes from SessionMiddleware, registering doesn't change it
         menu = get_admin_menu() if user_is_admin else get_main_menu(is_admin=user_is_admin)
 
         await message.answer(
@@ -139,8 +140,6 @@ async def process_phone(message: Message, state: FSMContext):
             # Handle the deep link after registration
             await handle_deep_link(message, deep_link, state)
     else:
-        # Check if user is admin
-        user_is_admin = await is_admin(message.from_user.id)
         menu = get_admin_menu() if user_is_admin else get_main_menu(is_admin=user_is_admin)
 
         await message.answer(
@@ -120,13 +120,45 @@ def get_buy_keyboard(lot_id: int, bot_username: str = None) -> InlineKeyboardMar
     return kb.as_markup()
 
 
+def get_carousel_keyboard(lot: dict, position: int, total: int) -> InlineKeyboardMarkup:
+    """Keyboard for browsing current lots one at a time"""
+    kb = InlineKeyboardBuilder()
+    lot_id = lot['id']
+
+    if lot.get('lot_type') == 'auction':
+        kb.button(text="🎯 Участвовать", callback_data=f"participate:{lot_id}")
+    else:
+        kb.button(text="📞 Связаться с продавцом", callback_data=f"contact_seller:{lot_id}")
+
+    sizes = [1]
+    photos_count = len(lot['photos'].split(',')) if lot.get('photos') else 0
+    if photos_count > 1:
+        kb.button(text=f"🖼 Все фото ({photos_count})", callback_data=f"carousel_photos:{lot_id}")
+        sizes.append(1)
+
+    navigation = 0
+    if position > 1:
+        kb.button(text="◀️", callback_data=f"carousel:{lot_id}:prev")
+        navigation += 1
+    kb.button(text=f"{position}/{total}", callback_data="carousel_noop")
+    navigation += 1
+    if position < total:
+        kb.button(text="▶️", callback_data=f"carousel:{lot_id}:next")
+        navigation += 1
+    sizes.append(navigation)
+
+    kb.adjust(*sizes)
+    return kb.as_markup()
+
+
 def get_bid_confirmation_keyboard(lot_id: int, amount: int) -> InlineKeyboardMarkup:
-    """Keyboard for confirming bid with three options"""
+    """Keyboard for confirming bid: place it, bid automatically up to it, change or stop"""
     kb = InlineKeyboardBuilder()
     kb.button(text="✅ Да", callback_data=f"confirm_bid:{lot_id}:{amount}")
     kb.button(text="✏️ Изменить", callback_data=f"change_bid:{lot_id}")
+    kb.button(text="🤖 Автоставка до этой суммы", callback_data=f"proxy_bid:{lot_id}:{amount}")
     kb.button(text="❌ Перестать участвовать", callback_data=f"stop_participation:{lot_id}")
-    kb.adjust(2)
+    kb.adjust(2, 1, 1)
     return kb.as_markup()
 
 
@@ -0,0 +1,18 @@
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import config
+from storage import SQLiteStorage
+
+# Bot, FSM storage and dispatcher shared by bot.py, handlers, outbox and scheduler
+if config.TELEGRAM_API_URL:
+    bot = Bot(token=config.BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=config.BOT_TOKEN)
+storage = SQLiteStorage(config.DATABASE_PATH)
+dp = Dispatcher(storage=storage)
+
+# Bot username and ID will be set on startup (read them as loader.bot_username at call time)
+bot_username = None
+bot_id = None
@@ -0,0 +1,177 @@
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    """Escape label value for the text exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric(ABC):
+    """Base class for metrics kept in process memory"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines in the text exposition format"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Value that goes up and down, or is computed by `func` on export"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 func: Callable[[], float] = None):
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.func = func
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        if self.func:
+            return self.func()
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        if self.func:
+            return [f"{self.name} {self.func()}"]
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """Bucketed observations plus a rolling window for percentiles"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window: int = 1000):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.window = window
+        self.series: Dict[Tuple[str, ...], Dict] = {}
+
+    def _series(self, key: Tuple[str, ...]) -> Dict:
+        series = self.series.get(key)
+        if series is None:
+            series = {
+                'buckets': [0] * len(self.buckets),
+                'count': 0,
+                'sum': 0.0,
+                'max': 0.0,
+                'recent': deque(maxlen=self.window)
+            }
+            self.series[key] = series
+        return series
+
+    def observe(self, value: float, **labels):
+        series = self._series(self._key(labels))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['count'] += 1
+        series['sum'] += value
+        series['max'] = max(series['max'], value)
+        series['recent'].append(value)
+
+    def percentile(self, q: float, **labels) -> Optional[float]:
+        """Percentile (0-100) over the last `window` observations"""
+        series = self.series.get(self._key(labels))
+        if not series or not series['recent']:
+            return None
+        values = sorted(series['recent'])
+        index = max(0, math.ceil(q / 100 * len(values)) - 1)
+        return values[index]
+
+    def stats(self, **labels) -> Dict[str, float]:
+        """Count, average, max and rolling p50/p95/p99"""
+        series = self.series.get(self._key(labels))
+        if not series or not series['count']:
+            return {'count': 0, 'avg': 0.0, 'max': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+        return {
+            'count': series['count'],
+            'avg': series['sum'] / series['count'],
+            'max': series['max'],
+            'p50': self.percentile(50, **labels),
+            'p95': self.percentile(95, **labels),
+            'p99': self.percentile(99, **labels)
+        }
+
+    def label_values(self) -> List[Dict[str, str]]:
+        """All label combinations observed so far"""
+        return [dict(zip(self.labelnames, key)) for key in self.series]
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in self.series.items():
+            for bound, count in zip(self.buckets, series['buckets']):
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': bound})} {count}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': '+Inf'})} {series['count']}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {series['count']}")
+        return lines
+
+
+# All metrics created in the process
+registry: List[Metric] = []
+
+# Functions that update derived gauges right before export
+collectors: List[Callable[[], None]] = []
+
+
+def export_metrics() -> str:
+    """Render all metrics in Prometheus text exposition format"""
+    for collect in collectors:
+        collect()
+    return '\n'.join(metric.render() for metric in registry) + '\n'
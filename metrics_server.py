@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from aiohttp import web
+
+from metrics import Gauge, Histogram, export_metrics
+import config
+
+logger = logging.getLogger(__name__)
+
+event_loop_lag = Histogram(
+    'bot_event_loop_lag_seconds', 'How late a timer fired on the event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+event_loop_lag_last = Gauge('bot_event_loop_lag_last_seconds', 'Event loop lag at the last check')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+async def monitor_event_loop_lag(interval: float):
+    """Sleep `interval` seconds in a loop and record how much later than planned the loop woke us"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - started - interval, 0)
+        event_loop_lag.observe(lag)
+        event_loop_lag_last.set(lag)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Prometheus scrape endpoint"""
+    return web.Response(body=export_metrics().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+class MetricsServer:
+    """aiohttp server exposing /metrics, plus the event loop lag probe"""
+
+    def __init__(self):
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    async def start(self, host: str = config.METRICS_HOST, port: int = config.METRICS_PORT):
+        app = web.Application()
+        app.router.add_get('/metrics', handle_metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._lag_task = asyncio.create_task(monitor_event_loop_lag(config.LOOP_LAG_INTERVAL_SECONDS))
+        logger.info(f"📈 Metrics available at http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Global metrics server, started by bot.py when METRICS_PORT is set
+metrics_server = MetricsServer()
@@ -0,0 +1,19 @@
+# Middlewares package
+from middlewares.album import AlbumMiddleware
+from middlewares.concurrency import ConcurrencyMiddleware
+from middlewares.session import SessionMiddleware, get_session, invalidate_session
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.latency import LatencyMiddleware, HandlerNameMiddleware, ApiTimingMiddleware, setup_latency_middleware
+
+__all__ = [
+    'AlbumMiddleware',
+    'ConcurrencyMiddleware',
+    'SessionMiddleware',
+    'get_session',
+    'invalidate_session',
+    'ThrottlingMiddleware',
+    'LatencyMiddleware',
+    'HandlerNameMiddleware',
+    'ApiTimingMiddleware',
+    'setup_latency_middleware'
+]
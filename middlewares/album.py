@@ -0,0 +1,42 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+import config
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """Collect messages of one media group and call the handler once with data['album']"""
+
+    def __init__(self, latency: float = config.ALBUM_LATENCY_SECONDS):
+        self.latency = latency
+        # {(chat_id, media_group_id): [messages]}
+        self.albums: Dict[Tuple[int, str], List[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Message) or not event.media_group_id:
+            return await handler(event, data)
+
+        if 'album' in data:
+            # Already collected by ConcurrencyMiddleware
+            return await handler(data['album'][0], data)
+
+        key = (event.chat.id, event.media_group_id)
+        if key in self.albums:
+            # The first message of the album will hand this one to the handler
+            self.albums[key].append(event)
+            return None
+
+        # Album messages arrive as separate updates, wait for the rest of them
+        self.albums[key] = [event]
+        await asyncio.sleep(self.latency)
+        album = sorted(self.albums.pop(key), key=lambda message: message.message_id)
+
+        data['album'] = album
+        return await handler(album[0], data)
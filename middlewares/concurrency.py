@@ -0,0 +1,137 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject, Update
+
+from metrics import Gauge, Histogram
+import config
+
+updates_in_progress = Gauge('bot_updates_in_progress', 'Updates being handled right now')
+updates_waiting = Gauge('bot_updates_waiting', 'Updates waiting for a user/lot lock or a free slot')
+update_queue_wait = Histogram('bot_update_queue_wait_seconds', 'Time an update waited before handling')
+
+# Callbacks that change a lot are also serialized per lot: "<prefix><lot_id>:..."
+# (bids are serialized by the lot's actor in bidding.py, so they can be stored in batches)
+LOT_LOCK_PREFIXES = ()
+
+
+class KeyedLocks:
+    """asyncio locks created on demand and dropped when nobody holds or waits for them"""
+
+    def __init__(self):
+        # {key: [lock, users]}
+        self._locks: Dict[Hashable, list] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+def get_lot_lock_id(update: Update) -> Optional[int]:
+    """Lot ID for updates that must not run concurrently with others on the same lot"""
+    callback = update.callback_query
+    if callback and callback.data and callback.data.startswith(LOT_LOCK_PREFIXES):
+        try:
+            return int(callback.data.split(":")[1])
+        except (IndexError, ValueError):
+            return None
+    return None
+
+
+class ConcurrencyMiddleware(BaseMiddleware):
+    """Outer update middleware: bounded parallelism, updates of one user (and bids on one lot) in order"""
+
+    def __init__(self, limit: int = config.MAX_CONCURRENT_UPDATES):
+        self.slots = asyncio.Semaphore(limit)
+        self.user_locks = KeyedLocks()
+        self.lot_locks = KeyedLocks()
+        # Albums being collected by their first message: {(chat_id, media_group_id): [messages]}
+        self.albums: Dict[Tuple[int, str], List[Message]] = {}
+        # Updates waiting or being handled, shutdown waits for them
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        user_key = user.id if user else None
+        lot_id = get_lot_lock_id(event) if isinstance(event, Update) else None
+
+        # An album is handled as one unit in the place of its first message in the user's
+        # queue: that message collects the other parts, which stop here
+        album_key = None
+        message = event.message if isinstance(event, Update) else None
+        if message and message.media_group_id:
+            album_key = (message.chat.id, message.media_group_id)
+            if album_key in self.albums:
+                self.albums[album_key].append(message)
+                return None
+            self.albums[album_key] = [message]
+            collect_until = time.monotonic() + config.ALBUM_LATENCY_SECONDS
+
+        queued = time.perf_counter()
+        updates_waiting.inc()
+        waiting = True
+        self.active += 1
+        self._idle.clear()
+        try:
+            # Locks are taken in a fixed order (user, lot, slot), so updates can't deadlock.
+            # asyncio.Lock wakes waiters in FIFO order, which keeps a user's updates in order.
+            async with self._hold(self.user_locks, user_key):
+                if album_key:
+                    # Wait for the rest of the album, the user's later updates queue behind it
+                    await asyncio.sleep(max(collect_until - time.monotonic(), 0))
+                    data['album'] = sorted(self.albums.pop(album_key), key=lambda part: part.message_id)
+                async with self._hold(self.lot_locks, lot_id):
+                    async with self.slots:
+                        updates_waiting.dec()
+                        waiting = False
+                        update_queue_wait.observe(time.perf_counter() - queued)
+
+                        updates_in_progress.inc()
+                        try:
+                            return await handler(event, data)
+                        finally:
+                            updates_in_progress.dec()
+        finally:
+            if waiting:
+                updates_waiting.dec()
+            if album_key:
+                self.albums.pop(album_key, None)
+            self.active -= 1
+            if not self.active:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for updates in flight, returns whether all of them finished"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @asynccontextmanager
+    async def _hold(self, locks: KeyedLocks, key: Optional[Hashable]):
+        if key is None:
+            yield
+            return
+        async with locks.hold(key):
+            yield
@@ -0,0 +1,124 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from metrics import Counter, Gauge, Histogram
+from timing import add_timing, finish_update_timing, get_update_timing, start_update_timing
+import config
+
+logger = logging.getLogger(__name__)
+
+updates_total = Counter('bot_updates_total', 'Updates received', ('type',))
+update_duration = Histogram('bot_update_duration_seconds', 'Time to handle an update', ('handler',))
+update_db_time = Histogram('bot_update_db_seconds', 'Time spent in database calls per update', ('handler',))
+update_api_time = Histogram('bot_update_api_seconds', 'Time spent in Bot API calls per update', ('handler',))
+api_request_duration = Histogram('bot_api_request_seconds', 'Bot API request time', ('method',))
+api_request_errors = Counter('bot_api_errors_total', 'Bot API requests that failed', ('method', 'error'))
+time_to_first_update = Gauge('bot_time_to_first_update_seconds', 'Time from process start until the first update was handled')
+
+
+class LatencyMiddleware(BaseMiddleware):
+    """Outer update middleware: times every update and logs slow ones with a breakdown"""
+
+    def __init__(self, started_at: Optional[float] = None):
+        # time.monotonic() at process start, reset after the first update is reported
+        self.started_at = started_at
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        updates_total.inc(type=getattr(event, 'event_type', 'unknown'))
+        record, token = start_update_timing()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            finish_update_timing(token)
+
+            if self.started_at is not None:
+                first_update = time.monotonic() - self.started_at
+                self.started_at = None
+                time_to_first_update.set(first_update)
+                logger.info(f"⏱ First update handled {first_update:.2f}s after launch")
+
+            name = record['handler'] or 'unhandled'
+            update_duration.observe(elapsed, handler=name)
+            update_db_time.observe(record['db'], handler=name)
+            update_api_time.observe(record['api'], handler=name)
+
+            if elapsed >= config.SLOW_UPDATE_SECONDS:
+                other = max(elapsed - record['db'] - record['api'], 0)
+                logger.warning(
+                    f"🐢 Slow update {event.update_id} ({name}): {elapsed:.2f}s - "
+                    f"db {record['db']:.2f}s in {record['db_calls']} calls, "
+                    f"api {record['api']:.2f}s in {record['api_calls']} calls, other {other:.2f}s"
+                )
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware: records which handler processes the update"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        record = get_update_timing()
+        if record is not None and 'handler' in data:
+            record['handler'] = data['handler'].callback.__name__
+        return await handler(event, data)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: times Bot API requests"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            api_request_errors.inc(method=method.__api_method__, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            api_request_duration.observe(elapsed, method=method.__api_method__)
+            add_timing('api', elapsed)
+
+
+def setup_latency_middleware(dp: Dispatcher, bot: Bot, started_at: Optional[float] = None):
+    """Register update, handler and Bot API timing middlewares"""
+    dp.update.outer_middleware(LatencyMiddleware(started_at))
+
+    handler_names = HandlerNameMiddleware()
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(handler_names)
+
+    bot.session.middleware(ApiTimingMiddleware())
+
+
+def get_handler_stats() -> List[Dict[str, Any]]:
+    """Latency summary by handler, slowest p95 first"""
+    stats = []
+    for labels in update_duration.label_values():
+        stats.append({
+            'handler': labels['handler'],
+            'duration': update_duration.stats(**labels),
+            'db': update_db_time.stats(**labels),
+            'api': update_api_time.stats(**labels)
+        })
+    return sorted(stats, key=lambda item: item['duration']['p95'], reverse=True)
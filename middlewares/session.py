@@ -0,0 +1,41 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from cache import TTLCache
+from database import db
+import config
+
+# {telegram_id: (user record or None, is admin)}
+user_sessions = TTLCache('sessions', maxsize=config.SESSION_CACHE_SIZE, ttl=config.SESSION_CACHE_TTL_SECONDS)
+
+
+async def get_session(telegram_id: int) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """User record and admin flag, cached for SESSION_CACHE_TTL_SECONDS"""
+    session = user_sessions.get(telegram_id)
+    if session is None:
+        session = (await db.get_user(telegram_id), await db.is_admin(telegram_id))
+        user_sessions.set(telegram_id, session)
+    return session
+
+
+def invalidate_session(telegram_id: int):
+    """Forget cached user data after registration or role change"""
+    user_sessions.pop(telegram_id)
+
+
+class SessionMiddleware(BaseMiddleware):
+    """Outer middleware: loads the user once per update, handlers get `db_user` and `user_is_admin`"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user:
+            data['db_user'], data['user_is_admin'] = await get_session(user.id)
+        else:
+            data['db_user'], data['user_is_admin'] = None, False
+        return await handler(event, data)
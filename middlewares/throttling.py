@@ -0,0 +1,82 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from cache import TTLCache
+from metrics import Counter
+import config
+
+throttled_total = Counter('bot_throttled_total', 'Updates dropped by anti-flood throttling', ('action',))
+
+THROTTLED_TEXT = "⏳ Слишком часто! Подождите немного и попробуйте снова."
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` at once"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at', 'warned')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        # Message floods are answered once, not on every dropped message
+        self.warned = False
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.warned = False
+        return True
+
+
+def get_action(event: TelegramObject, data: Dict[str, Any]) -> Optional[str]:
+    """Callback data prefix for callbacks, handler name for messages"""
+    if isinstance(event, CallbackQuery):
+        return event.data.split(":")[0] if event.data else None
+    handler = data.get('handler')
+    return handler.callback.__name__ if handler else None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Inner middleware: per-user, per-action token buckets for expensive actions"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]] = None):
+        # {action: (tokens per second, burst)}
+        self.limits = config.THROTTLE_LIMITS if limits is None else limits
+        # Idle buckets are full anyway, so forgetting them is safe
+        self.buckets = TTLCache('throttling', maxsize=config.THROTTLE_CACHE_SIZE, ttl=config.THROTTLE_IDLE_SECONDS)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        action = get_action(event, data)
+        user = data.get('event_from_user')
+        if action not in self.limits or not user:
+            return await handler(event, data)
+
+        key = (user.id, action)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*self.limits[action])
+        # Re-set on every use to extend the idle timeout
+        self.buckets.set(key, bucket)
+
+        if bucket.take():
+            return await handler(event, data)
+
+        throttled_total.inc(action=action)
+        if isinstance(event, CallbackQuery):
+            await event.answer(THROTTLED_TEXT)
+        elif isinstance(event, Message) and not bucket.warned:
+            bucket.warned = True
+            await event.answer(THROTTLED_TEXT)
+        return None
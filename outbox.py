@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+import clock
+from database import db
+from metrics import Counter
+import config
+
+logger = logging.getLogger(__name__)
+
+notifications_total = Counter('outbox_notifications_total', 'Notification delivery attempts', ('result',))
+
+
+def pack_message(chat_id: int, text: str, parse_mode: str = None, reply_markup=None) -> Dict[str, Any]:
+    """Convert send_message arguments to an outbox row"""
+    return {
+        'chat_id': chat_id,
+        'text': text,
+        'parse_mode': parse_mode,
+        'reply_markup': reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+    }
+
+
+def pack_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Convert a list of send_message kwargs to outbox rows"""
+    return [pack_message(**message) for message in messages]
+
+
+def unpack_markup(reply_markup: Optional[str]):
+    """Restore keyboard stored in the outbox"""
+    if not reply_markup:
+        return None
+    data = json.loads(reply_markup)
+    if 'inline_keyboard' in data:
+        return InlineKeyboardMarkup.model_validate(data)
+    return ReplyKeyboardMarkup.model_validate(data)
+
+
+def get_retry_delay(attempts: int) -> float:
+    """Exponential backoff: base, 2*base, 4*base... capped by OUTBOX_MAX_BACKOFF_SECONDS"""
+    return min(config.OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), config.OUTBOX_MAX_BACKOFF_SECONDS)
+
+
+class OutboxWorker:
+    """Background delivery of outbox notifications with retries and dead letters"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        # Only one delivery pass at a time; other instances are kept off by row leases
+        self._lock = asyncio.Lock()
+        self._stopping = False
+
+    def start(self):
+        """Start background delivery loop"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 0) -> bool:
+        """Stop background delivery loop after one last pass, cancelled if it takes longer than `timeout` seconds"""
+        if not self._task:
+            return True
+
+        self._stopping = True
+        self.wake()
+        done, _ = await asyncio.wait({self._task}, timeout=timeout)
+        if not done:
+            # Leased rows that were not sent are retried by the next instance once the lease expires
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._stopping = False
+        return bool(done)
+
+    def wake(self):
+        """Deliver new notifications without waiting for the next poll"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Outbox delivery pass failed: {e}")
+
+            if self._stopping:
+                return
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=config.OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def flush(self) -> int:
+        """Deliver all notifications that are due now, returns how many were sent"""
+        sent = 0
+        async with self._lock:
+            while True:
+                now = clock.now()
+                rows = await db.claim_due_notifications(
+                    now.isoformat(),
+                    config.INSTANCE_ID,
+                    (now + timedelta(seconds=config.OUTBOX_LEASE_SECONDS)).isoformat(),
+                    config.OUTBOX_BATCH_SIZE
+                )
+                if not rows:
+                    return sent
+
+                semaphore = asyncio.Semaphore(config.OUTBOX_CONCURRENCY)
+
+                async def deliver(row: Dict[str, Any]) -> bool:
+                    async with semaphore:
+                        return await self._deliver(row)
+
+                results = await asyncio.gather(*(deliver(row) for row in rows))
+                sent += sum(results)
+
+                if len(rows) < config.OUTBOX_BATCH_SIZE:
+                    return sent
+
+    async def _deliver(self, row: Dict[str, Any]) -> bool:
+        """Send one notification and record the outcome"""
+        from loader import bot
+
+        try:
+            await bot.send_message(
+                chat_id=row['chat_id'],
+                text=row['text'],
+                parse_mode=row['parse_mode'],
+                reply_markup=unpack_markup(row['reply_markup'])
+            )
+        except Exception as e:
+            attempts = row['attempts'] + 1
+            # User blocked the bot or chat doesn't exist - retrying won't help
+            dead = isinstance(e, (TelegramForbiddenError, TelegramBadRequest)) or attempts >= config.OUTBOX_MAX_ATTEMPTS
+            delay = e.retry_after if isinstance(e, TelegramRetryAfter) else get_retry_delay(attempts)
+            next_attempt_at = (clock.now() + timedelta(seconds=delay)).isoformat()
+
+            await db.mark_notification_failed(row['id'], attempts, next_attempt_at, str(e), dead=dead)
+            notifications_total.inc(result='dead' if dead else 'retry')
+            if dead:
+                logger.error(f"Notification {row['id']} to {row['chat_id']} moved to dead letters: {e}")
+            else:
+                logger.warning(f"Notification {row['id']} to {row['chat_id']} failed (attempt {attempts}), retry in {delay}s: {e}")
+            return False
+
+        await db.mark_notification_sent(row['id'])
+        notifications_total.inc(result='sent')
+        return True
+
+
+# Global outbox worker
+outbox = OutboxWorker()
@@ -1,53 +1,159 @@
+import asyncio
+import logging
+import time
 from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Set
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
+from bidding import bid_book
+from cache import TTLCache, purge_expired_caches
+import clock
 from database import db
-from utils import format_price
+from metrics import Counter, Gauge, Histogram
+from outbox import outbox, pack_messages
+from utils import format_price, get_due_checkpoint, RateLimiter
 import config
 
 scheduler = AsyncIOScheduler()
+logger = logging.getLogger(__name__)
+
+# Shared by every channel edit so that parallel passes don't exceed the channel limit
+channel_edit_limiter = RateLimiter(config.CHANNEL_EDITS_PER_SECOND)
+
+# Last countdown checkpoint shown in the channel: {lot_id: minutes_before_end}
+refreshed_checkpoints = TTLCache(
+    'countdown_checkpoints',
+    maxsize=config.STATE_CACHE_SIZE,
+    ttl=config.EFFECTIVE_AUCTION_DURATION_MINUTES * 60 + 3600
+)
+
+# Job metrics, kind is one of: completion, sweep, update, notify, maintenance
+JOB_KINDS = ('completion', 'sweep', 'update', 'notify', 'maintenance')
+job_lag = Histogram('scheduler_job_lag_seconds', 'Delay between planned fire time and actual start', ('kind',))
+job_duration = Histogram('scheduler_job_duration_seconds', 'Scheduler job execution time', ('kind',))
+job_failures = Counter('scheduler_job_failures_total', 'Scheduler jobs that raised an error', ('kind',))
+job_missed = Counter('scheduler_jobs_missed_total', 'Scheduler jobs skipped because they fired too late', ('kind',))
+active_auctions_total = Gauge('auctions_active', 'Active auctions at the last countdown refresh')
+pending_timers = Gauge('scheduler_pending_timers', 'Jobs waiting in the scheduler', func=lambda: len(scheduler.get_jobs()))
+
+# Planned fire time of submitted jobs until they start: {job_id: datetime}
+_planned_run_times = TTLCache('planned_run_times', maxsize=config.STATE_CACHE_SIZE, ttl=3600)
+
+# Jobs being executed right now, shutdown lets them finish
+_running_jobs: Set[asyncio.Task] = set()
+
+
+def _job_kind(job_id: str) -> str:
+    """Get metrics kind from job id"""
+    if job_id == "countdown_refresh":
+        return "update"
+    if job_id == "completion_sweep":
+        return "sweep"
+    if job_id == "cache_purge":
+        return "maintenance"
+    if "_notify_" in job_id:
+        return "notify"
+    return "completion"
+
+
+def _on_job_event(event):
+    """Remember planned fire time of submitted jobs and count missed ones"""
+    if event.code == EVENT_JOB_SUBMITTED:
+        _planned_run_times.set(event.job_id, event.scheduled_run_times[-1])
+    elif event.code == EVENT_JOB_MISSED:
+        job_missed.inc(kind=_job_kind(event.job_id))
+        logger.warning(f"⚠️ Scheduler job {event.job_id} missed its run time {event.scheduled_run_time}")
+
+
+scheduler.add_listener(_on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
+
+
+async def run_job(job_id: str, func: Callable[..., Awaitable[Any]], *args):
+    """Run scheduler job recording its lag, duration and failures"""
+    kind = _job_kind(job_id)
+    planned = _planned_run_times.pop(job_id, None)
+    if planned:
+        lag = (datetime.now(planned.tzinfo) - planned).total_seconds()
+        job_lag.observe(lag, kind=kind)
+        if lag > config.SCHEDULER_LAG_ALERT_SECONDS:
+            logger.warning(f"⚠️ Scheduler lag alert: {job_id} started {lag:.1f}s after planned time")
+
+    started = time.perf_counter()
+    task = asyncio.current_task()
+    _running_jobs.add(task)
+    try:
+        await func(*args)
+    except Exception:
+        job_failures.inc(kind=kind)
+        logger.exception(f"Scheduler job {job_id} failed")
+    finally:
+        _running_jobs.discard(task)
+        job_duration.observe(time.perf_counter() - started, kind=kind)
+
+
+def add_job(func: Callable[..., Awaitable[Any]], trigger, job_id: str, args: list = None, **kwargs):
+    """Add job to the scheduler wrapped with metrics"""
+    scheduler.add_job(
+        run_job,
+        trigger,
+        args=[job_id, func, *(args or [])],
+        id=job_id,
+        name=func.__name__,
+        **kwargs
+    )
+
+
+def get_scheduler_stats() -> Dict[str, Any]:
+    """Scheduler metrics summary by job kind"""
+    return {
+        'pending_timers': pending_timers.get(),
+        'kinds': {
+            kind: {
+                'lag': job_lag.stats(kind=kind),
+                'duration': job_duration.stats(kind=kind),
+                'failures': job_failures.get(kind=kind),
+                'missed': job_missed.get(kind=kind)
+            }
+            for kind in JOB_KINDS
+        }
+    }
 
 
 async def schedule_auction_completion(lot_id: int, end_time: datetime):
     """Schedule auction completion"""
-    scheduler.add_job(
+    # Recovery runs while updates are handled, so a first bid may have scheduled the lot already
+    add_job(
         complete_auction,
         DateTrigger(run_date=end_time),
+        job_id=f"auction_{lot_id}_complete",
         args=[lot_id],
-        id=f"auction_{lot_id}_complete"
+        replace_existing=True
     )
 
-    # Schedule channel updates (every 30 min and at key moments)
-    update_intervals = [5]  # minutes before end (adjusted for 10-minute auctions)
-
-    for minutes in update_intervals:
-        update_time = end_time - timedelta(minutes=minutes)
-        if update_time > datetime.now():
-            scheduler.add_job(
-                update_auction_status,
-                DateTrigger(run_date=update_time),
-                args=[lot_id],
-                id=f"auction_{lot_id}_update_{minutes}"
-            )
+    # Channel countdown is refreshed by the shared refresh_countdowns job
 
     # Schedule participant notifications before auction ends
     notification_intervals = [5]  # notify participants 5 minutes before end
 
     for minutes in notification_intervals:
         notification_time = end_time - timedelta(minutes=minutes)
-        if notification_time > datetime.now():
-            scheduler.add_job(
+        if notification_time > clock.now():
+            add_job(
                 notify_participants_before_end,
                 DateTrigger(run_date=notification_time),
+                job_id=f"auction_{lot_id}_notify_{minutes}",
                 args=[lot_id, minutes],
-                id=f"auction_{lot_id}_notify_{minutes}"
+                replace_existing=True
             )
 
 
 async def notify_participants_before_end(lot_id: int, minutes_left: int):
     """Notify all auction participants that auction is ending soon"""
-    from bot import bot
+    from loader import bot
     from keyboards import get_outbid_keyboard
 
     lot = await db.get_lot(lot_id)
@@ -89,20 +195,15 @@ async def notify_participants_before_end(lot_id: int, minutes_left: int):
             print(f"Failed to notify participant {participant_id}: {e}")
 
 
-async def update_auction_status(lot_id: int):
-    """Update auction status in channel"""
-    from bot import bot
+async def edit_channel_status(lot: Dict[str, Any]):
+    """Edit channel post of the lot to show its current status and countdown"""
+    from loader import bot
     from utils import format_lot_message, format_auction_status, get_photos_list
     from keyboards import get_participate_keyboard
 
-    lot = await db.get_lot(lot_id)
-
-    if not lot or not lot.get('channel_message_id'):
-        return
+    photos = get_photos_list(lot['photos'])
 
     try:
-        photos = get_photos_list(lot['photos'])
-
         if len(photos) == 1:
             # Single photo - edit caption
             lot_type_label = "🔥 Аукцион" if lot.get('lot_type') == 'auction' else "💐 Букет на продажу"
@@ -113,243 +214,367 @@ async def update_auction_status(lot_id: int):
                 message_id=lot['channel_message_id'],
                 caption=updated_text,
                 parse_mode="HTML",
-                reply_markup=get_participate_keyboard(lot_id)
+                reply_markup=get_participate_keyboard(lot['id'])
             )
-        else:
+        elif lot.get('channel_button_message_id'):
             # Media group - edit button message with status
-            if lot.get('channel_button_message_id'):
-                button_text = "👇 Нажмите чтобы участвовать в аукционе\n\n"
-                button_text += format_auction_status(lot)
-
-                await bot.edit_message_text(
-                    chat_id=config.CHANNEL_ID,
-                    message_id=lot['channel_button_message_id'],
-                    text=button_text,
-                    parse_mode="HTML",
-                    reply_markup=get_participate_keyboard(lot_id)
-                )
+            button_text = "👇 Нажмите чтобы участвовать в аукционе\n\n"
+            button_text += format_auction_status(lot)
 
-    except Exception as e:
-        print(f"Failed to update auction {lot_id}: {e}")
+            await bot.edit_message_text(
+                chat_id=config.CHANNEL_ID,
+                message_id=lot['channel_button_message_id'],
+                text=button_text,
+                parse_mode="HTML",
+                reply_markup=get_participate_keyboard(lot['id'])
+            )
+    except TelegramBadRequest as e:
+        # Countdown text didn't change since the last edit
+        if "message is not modified" not in str(e):
+            raise
+
+
+async def run_channel_edits(lots: List[Dict[str, Any]],
+                            edit: Callable[[Dict[str, Any]], Awaitable[Any]]) -> List[Dict[str, Any]]:
+    """Apply edit to every lot through a bounded pool of rate-limited workers, returns the lots whose edit failed"""
+    queue = asyncio.Queue()
+    for lot in lots:
+        queue.put_nowait(lot)
+    failed = []
+
+    async def worker():
+        while not queue.empty():
+            lot = queue.get_nowait()
+            for attempt in range(2):
+                await channel_edit_limiter.wait()
+                try:
+                    await edit(lot)
+                    break
+                except TelegramRetryAfter as e:
+                    # Flood control - wait as asked and retry once
+                    logger.warning(f"Channel edit for lot {lot['id']} throttled, retry after {e.retry_after}s")
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logger.error(f"Failed to edit channel post of lot {lot['id']}: {e}")
+                    failed.append(lot)
+                    break
+            else:
+                logger.error(f"Dropped channel edit for lot {lot['id']}: still throttled after retry")
+                failed.append(lot)
+
+    workers = min(config.CHANNEL_EDIT_WORKERS, len(lots))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return failed
+
+
+async def refresh_countdowns():
+    """Refresh channel countdowns of all active auctions that reached a new checkpoint"""
+    now = clock.now()
+    active_auctions = await db.get_active_auctions()
+    active_auctions_total.set(len(active_auctions))
+
+    due = []
+    for lot in active_auctions:
+        if not lot.get('end_time') or not lot.get('channel_message_id'):
+            continue
+
+        checkpoint = get_due_checkpoint(datetime.fromisoformat(lot['end_time']), now)
+        if checkpoint is None or refreshed_checkpoints.get(lot['id']) == checkpoint:
+            continue
+
+        refreshed_checkpoints.set(lot['id'], checkpoint)
+        due.append(lot)
+
+    # Forget finished auctions
+    active_ids = {lot['id'] for lot in active_auctions}
+    for lot_id in refreshed_checkpoints.keys():
+        if lot_id not in active_ids:
+            refreshed_checkpoints.pop(lot_id)
+
+    if due:
+        failed = await run_channel_edits(due, edit_channel_status)
+        # Retry on the next refresh instead of waiting for the next checkpoint
+        for lot in failed:
+            refreshed_checkpoints.pop(lot['id'])
+        logger.info(f"⏱ Countdown refreshed for {len(due)} of {len(active_auctions)} active auctions")
 
 
 async def complete_auction(lot_id: int):
     """Complete auction and determine winner"""
-    from bot import bot
+    # Auctions ending at the same moment are finished together by one sweep,
+    # jobs that fire after it (here or in another instance) find their lot already claimed
+    await complete_due_auctions()
+
+
+async def complete_due_auctions() -> int:
+    """Finish every auction that reached its end time, returns how many were finished"""
+    started = time.perf_counter()
+
+    # Stage 1: claim due lots with a lease, only the claimant runs side effects;
+    # bids accepted before the end but not stored yet go in first
+    now = clock.now()
+    await bid_book.flush_due(now)
+    lease_until = (now + timedelta(seconds=config.COMPLETION_LEASE_SECONDS)).isoformat()
+    owner = config.INSTANCE_ID
+    claimed = await db.claim_due_auctions(now.isoformat(), owner, lease_until)
+    if not claimed:
+        return 0
+
+    # Stage 2: finalize claimed lots, notifications go to the outbox in the same transaction
+    messages = []
+
+    def build_notifications(lots, users, admin_ids):
+        for lot in lots:
+            messages.extend(build_completion_messages(lot, users, admin_ids))
+        return pack_messages(messages)
+
+    lots = await db.finalize_claimed_auctions([lot['id'] for lot in claimed], owner, build_notifications)
+    if not lots:
+        return 0
+
+    # Stage 3: outbox delivery and channel edits run side by side
+    published = [lot for lot in lots if lot.get('channel_message_id')]
+    await asyncio.gather(
+        outbox.flush(),
+        run_channel_edits(published, edit_channel_sold)
+    )
 
-    lot = await db.get_lot(lot_id)
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"🏁 Completed {len(lots)} auctions in {elapsed:.2f}s "
+        f"({len(lots) / elapsed:.1f} auctions/s, {len(messages)} notifications, {len(published)} channel edits)"
+    )
+    return len(lots)
 
-    if not lot:
-        print(f"ERROR: Lot {lot_id} not found!")
-        return
 
-    # Get all bids
-    bids = await db.get_lot_bids(lot_id)
+def _user_or_fallback(users: Dict[int, Dict[str, Any]], user_id: int) -> Dict[str, Any]:
+    """Get user from batch lookup or a placeholder if user is not in database"""
+    user = users.get(user_id)
+    if not user:
+        print(f"ERROR: User {user_id} not found in database!")
+        user = {
+            'name': f'Пользователь ID: {user_id}',
+            'username': None,
+            'phone': 'не указан'
+        }
+    return user
 
-    # Update status
-    if bids:
-        print(f"INFO: Completing auction {lot_id} with {len(bids)} bids")
-        await db.update_lot_status(lot_id, 'finished')
+
+def build_completion_messages(lot: Dict[str, Any], users: Dict[int, Dict[str, Any]],
+                              admin_ids: List[int]) -> List[Dict[str, Any]]:
+    """Build all notifications for a finalized auction as send_message kwargs"""
+    from keyboards import get_main_menu
+
+    lot_id = lot['id']
+    messages = []
+
+    def menu_for(user_id: int):
+        return get_main_menu(is_admin=user_id in admin_ids)
+
+    if lot['status'] == 'finished':
+        print(f"INFO: Completing auction {lot_id} with {len(lot['participants'])} participants")
 
         # Winner is the one with highest bid (already leader)
         winner_id = lot['leader_id']
         winning_bid = lot['current_price']
 
-        # Get winner and owner info
-        winner = await db.get_user(winner_id)
-        owner = await db.get_user(lot['owner_id'])
-
-        # Check if winner exists, use fallback if not
-        if not winner:
-            print(f"ERROR: Winner user {winner_id} not found in database!")
-            winner = {
-                'name': f'Пользователь ID: {winner_id}',
-                'username': None,
-                'phone': 'не указан'
-            }
-
-        # Check if owner exists, use fallback if not
-        if not owner:
-            print(f"ERROR: Owner user {lot['owner_id']} not found in database!")
-            owner = {
-                'name': f'Пользователь ID: {lot["owner_id"]}',
-                'username': None,
-                'phone': 'не указан'
-            }
+        winner = _user_or_fallback(users, winner_id)
+        owner = _user_or_fallback(users, lot['owner_id'])
 
         # Format usernames safely
         owner_username = f"@{owner['username']}" if owner.get('username') else "нет username"
         winner_username = f"@{winner['username']}" if winner.get('username') else "нет username"
 
         # Notify winner
-        try:
-            from utils import get_user_menu
-            menu = await get_user_menu(winner_id)
-            await bot.send_message(
-                chat_id=winner_id,
-                text=f"🎉 <b>Поздравляем! Вы выиграли аукцион!</b>\n\n"
-                     f"📦 <b>Лот:</b> {lot['description']}\n"
-                     f"💰 <b>Ваша ставка:</b> {format_price(winning_bid)} тенге\n"
-                     f"🏙️ <b>Город:</b> {lot['city']}\n\n"
-                     f"👤 <b>Контакт продавца:</b>\n"
-                     f"Имя: {owner['name']}\n"
-                     f"Username: {owner_username}\n"
-                     f"Телефон: {owner['phone']}\n\n"
-                     f"💬 Свяжитесь с продавцом для получения товара и оплаты",
-                parse_mode="HTML",
-                reply_markup=menu
-            )
-        except Exception as e:
-            print(f"Failed to notify winner: {e}")
+        messages.append(dict(
+            chat_id=winner_id,
+            text=f"🎉 <b>Поздравляем! Вы выиграли аукцион!</b>\n\n"
+                 f"📦 <b>Лот:</b> {lot['description']}\n"
+                 f"💰 <b>Ваша ставка:</b> {format_price(winning_bid)} тенге\n"
+                 f"🏙️ <b>Город:</b> {lot['city']}\n\n"
+                 f"👤 <b>Контакт продавца:</b>\n"
+                 f"Имя: {owner['name']}\n"
+                 f"Username: {owner_username}\n"
+                 f"Телефон: {owner['phone']}\n\n"
+                 f"💬 Свяжитесь с продавцом для получения товара и оплаты",
+            parse_mode="HTML",
+            reply_markup=menu_for(winner_id)
+        ))
 
         # Calculate profit percentage
         profit_percent = int(((winning_bid - lot['start_price']) / lot['start_price']) * 100) if lot['start_price'] > 0 else 0
 
         # Notify owner
-        try:
-            from utils import get_user_menu
-            menu = await get_user_menu(lot['owner_id'])
-            await bot.send_message(
-                chat_id=lot['owner_id'],
-                text=f"🎉 <b>Ваш лот продан!</b>\n\n"
-                     f"📦 <b>Лот:</b> {lot['description']}\n"
-                     f"💰 <b>Финальная цена:</b> {format_price(winning_bid)} тенге\n"
-                     f"🚀 <b>Рост от стартовой:</b> +{profit_percent}%\n\n"
-                     f"👤 <b>Контакт покупателя:</b>\n"
-                     f"Имя: {winner['name']}\n"
-                     f"Username: {winner_username}\n"
-                     f"Телефон: {winner['phone']}\n\n"
-                     f"💬 Свяжитесь с покупателем для передачи товара и получения оплаты",
-                parse_mode="HTML",
-                reply_markup=menu
-            )
-        except Exception as e:
-            print(f"Failed to notify owner: {e}")
+        messages.append(dict(
+            chat_id=lot['owner_id'],
+            text=f"🎉 <b>Ваш лот продан!</b>\n\n"
+                 f"📦 <b>Лот:</b> {lot['description']}\n"
+                 f"💰 <b>Финальная цена:</b> {format_price(winning_bid)} тенге\n"
+                 f"🚀 <b>Рост от стартовой:</b> +{profit_percent}%\n\n"
+                 f"👤 <b>Контакт покупателя:</b>\n"
+                 f"Имя: {winner['name']}\n"
+                 f"Username: {winner_username}\n"
+                 f"Телефон: {winner['phone']}\n\n"
+                 f"💬 Свяжитесь с покупателем для передачи товара и получения оплаты",
+            parse_mode="HTML",
+            reply_markup=menu_for(lot['owner_id'])
+        ))
 
         # Notify admins
-        admin_ids = await db.get_all_admin_ids()
         for admin_id in admin_ids:
-            try:
-                await bot.send_message(
-                    chat_id=admin_id,
-                    text=f"ℹ️ <b>Аукцион {lot_id} завершён</b>\n\n"
-                         f"Победитель: {winner['name']} ({winner_username})\n"
-                         f"Цена: {winning_bid} тенге",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                print(f"Failed to notify admin: {e}")
+            messages.append(dict(
+                chat_id=admin_id,
+                text=f"ℹ️ <b>Аукцион {lot_id} завершён</b>\n\n"
+                     f"Победитель: {winner['name']} ({winner_username})\n"
+                     f"Цена: {winning_bid} тенге",
+                parse_mode="HTML"
+            ))
 
         # Notify losers
-        from utils import get_user_menu
-        participants = await db.get_lot_participants(lot_id)
-        for participant_id in participants:
+        for participant_id in lot['participants']:
             if participant_id != winner_id:
-                try:
-                    menu = await get_user_menu(participant_id)
-                    await bot.send_message(
-                        chat_id=participant_id,
-                        text=f"😔 <b>Аукцион завершён</b>\n\n"
-                             f"📦 Лот: {lot['description']}\n"
-                             f"💔 Ваша ставка была перебита\n"
-                             f"💰 Финальная цена: {format_price(winning_bid)} тенге\n\n"
-                             f"Не расстраивайтесь, следите за новыми лотами в канале!",
-                        parse_mode="HTML",
-                        reply_markup=menu
-                    )
-                except Exception:
-                    pass
+                messages.append(dict(
+                    chat_id=participant_id,
+                    text=f"😔 <b>Аукцион завершён</b>\n\n"
+                         f"📦 Лот: {lot['description']}\n"
+                         f"💔 Ваша ставка была перебита\n"
+                         f"💰 Финальная цена: {format_price(winning_bid)} тенге\n\n"
+                         f"Не расстраивайтесь, следите за новыми лотами в канале!",
+                    parse_mode="HTML",
+                    reply_markup=menu_for(participant_id)
+                ))
 
     else:
-        # No bids
-        await db.update_lot_status(lot_id, 'no_bids')
-
-        # Notify owner
-        try:
-            from utils import get_user_menu
-            menu = await get_user_menu(lot['owner_id'])
-            await bot.send_message(
-                chat_id=lot['owner_id'],
-                text=f"😔 <b>Аукцион завершён</b>\n\n"
-                     f"📦 Лот: {lot['description']}\n"
-                     f"К сожалению, ставок не было.\n\n"
-                     f"💡 <b>Советы:</b>\n"
-                     f"• Снизьте стартовую цену\n"
-                     f"• Добавьте больше качественных фото\n"
-                     f"• Улучшите описание товара",
-                parse_mode="HTML",
-                reply_markup=menu
-            )
-        except Exception:
-            pass
+        # No bids - notify owner
+        messages.append(dict(
+            chat_id=lot['owner_id'],
+            text=f"😔 <b>Аукцион завершён</b>\n\n"
+                 f"📦 Лот: {lot['description']}\n"
+                 f"К сожалению, ставок не было.\n\n"
+                 f"💡 <b>Советы:</b>\n"
+                 f"• Снизьте стартовую цену\n"
+                 f"• Добавьте больше качественных фото\n"
+                 f"• Улучшите описание товара",
+            parse_mode="HTML",
+            reply_markup=menu_for(lot['owner_id'])
+        ))
 
         # Notify admins
-        admin_ids = await db.get_all_admin_ids()
         for admin_id in admin_ids:
-            try:
-                await bot.send_message(
-                    chat_id=admin_id,
-                    text=f"ℹ️ Лот {lot_id} завершён без ставок."
-                )
-            except Exception:
-                pass
-
-    # Update channel message to show "SOLD"
-    if lot.get('channel_message_id'):
-        try:
-            from utils import format_sold_message, get_photos_list
+            messages.append(dict(
+                chat_id=admin_id,
+                text=f"ℹ️ Лот {lot_id} завершён без ставок."
+            ))
+
+    return messages
+
+
+async def edit_channel_sold(lot: Dict[str, Any]):
+    """Edit channel post of a finished lot to show "SOLD" and remove the keyboard"""
+    from loader import bot
+    from utils import format_sold_message, get_photos_list
+
+    # Determine final price
+    final_price = lot.get('current_price', lot['start_price'])
+    print(f"INFO: Updating channel message for lot {lot['id']}, final price: {final_price}")
+
+    # Format sold message
+    sold_text = format_sold_message(lot, final_price)
+
+    # Get photos to determine if it's a single photo or media group
+    photos = get_photos_list(lot['photos'])
+
+    # Edit message (remove keyboard to prevent further interaction)
+    if len(photos) == 1:
+        # Single photo - edit caption
+        await bot.edit_message_caption(
+            chat_id=config.CHANNEL_ID,
+            message_id=lot['channel_message_id'],
+            caption=sold_text,
+            parse_mode="HTML",
+            reply_markup=None
+        )
+    elif lot.get('channel_button_message_id'):
+        # Media group - edit button message to show final status
+        await bot.edit_message_text(
+            chat_id=config.CHANNEL_ID,
+            message_id=lot['channel_button_message_id'],
+            text=sold_text,
+            parse_mode="HTML",
+            reply_markup=None
+        )
+    print(f"SUCCESS: Channel message updated for lot {lot['id']}")
+
+
+async def purge_caches():
+    """Drop expired cache entries"""
+    purged = purge_expired_caches()
+    if purged:
+        logger.info(f"🗑 Purged {purged} expired cache entries")
 
-            # Determine final price
-            final_price = lot.get('current_price', lot['start_price'])
-            print(f"INFO: Updating channel message for lot {lot_id}, final price: {final_price}")
 
-            # Format sold message
-            sold_text = format_sold_message(lot, final_price)
+def start_scheduler():
+    """Start the scheduler"""
+    # One job refreshes all live channel posts instead of a job per auction
+    add_job(
+        refresh_countdowns,
+        IntervalTrigger(seconds=config.COUNTDOWN_REFRESH_SECONDS),
+        job_id="countdown_refresh",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    # Safety net: picks up auctions whose job was missed or whose lease expired
+    add_job(
+        complete_due_auctions,
+        IntervalTrigger(seconds=config.COMPLETION_SWEEP_SECONDS),
+        job_id="completion_sweep",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    # Drop expired entries of in-process caches nobody asked for again
+    add_job(
+        purge_caches,
+        IntervalTrigger(seconds=config.CACHE_PURGE_SECONDS),
+        job_id="cache_purge",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    scheduler.start()
 
-            # Get photos to determine if it's a single photo or media group
-            photos = get_photos_list(lot['photos'])
 
-            # Edit message (remove keyboard to prevent further interaction)
-            if len(photos) == 1:
-                # Single photo - edit caption
-                await bot.edit_message_caption(
-                    chat_id=config.CHANNEL_ID,
-                    message_id=lot['channel_message_id'],
-                    caption=sold_text,
-                    parse_mode="HTML",
-                    reply_markup=None
-                )
-            else:
-                # Media group - edit button message to show final status
-                if lot.get('channel_button_message_id'):
-                    await bot.edit_message_text(
-                        chat_id=config.CHANNEL_ID,
-                        message_id=lot['channel_button_message_id'],
-                        text=sold_text,
-                        parse_mode="HTML",
-                        reply_markup=None
-                    )
-            print(f"SUCCESS: Channel message updated for lot {lot_id}")
-        except Exception as e:
-            print(f"Failed to update channel message: {e}")
+async def stop_scheduler(timeout: float) -> bool:
+    """Stop firing jobs, wait up to `timeout` seconds for running ones, then shut the scheduler down"""
+    if not scheduler.running:
+        return True
 
+    scheduler.pause()
+    finished = True
+    if _running_jobs:
+        _, pending = await asyncio.wait(set(_running_jobs), timeout=timeout)
+        finished = not pending
+        if pending:
+            logger.warning(f"⚠️ {len(pending)} scheduler jobs still running at shutdown")
 
-def start_scheduler():
-    """Start the scheduler"""
-    scheduler.start()
+    # Timers live in memory only: lots and notifications are in the database, so
+    # recover_active_auctions reschedules them and the sweep finishes claimed lots on the next start
+    logger.info(f"Scheduler stopped with {len(scheduler.get_jobs())} pending timers")
+    scheduler.shutdown(wait=False)
+    return finished
 
 
 async def recover_active_auctions():
     """Recover active auctions on bot restart"""
+    # Complete all auctions that ended while the bot was down in one batch
+    await complete_due_auctions()
+
     active_auctions = await db.get_active_auctions()
 
     for lot in active_auctions:
         if lot['end_time']:
             end_time = datetime.fromisoformat(lot['end_time'])
 
-            # If auction already ended, complete it
-            if end_time <= datetime.now():
-                await complete_auction(lot['id'])
-            else:
-                # Reschedule
-                await schedule_auction_completion(lot['id'], end_time)
+            # Reschedule (auctions ending right now are picked up by the job immediately)
+            await schedule_auction_completion(lot['id'], end_time)
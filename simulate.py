@@ -0,0 +1,338 @@
+"""
+Simulated-clock harness for the scheduler and auction lifecycle.
+
+Creates thousands of lots in a temporary database, installs a VirtualClock and
+fires the scheduler job callables (completion, reminders, countdown refresh,
+completion sweep) at their planned virtual times - no real sleeping. Bids go
+through the real confirm_bid handler with dp.feed_update, and Bot API calls go
+to fake_telegram.py running in the same process, so only the clock and the
+Bot API are faked.
+
+Checks:
+- every started auction is completed exactly once and not before its end time
+- auctions complete in end-time order and within one tick of their end time
+- notification and channel edit counts match the bids that were placed
+- lots without bids are left untouched
+
+Usage:
+    python simulate.py --lots 2000 --bidders 300
+Exit code is 1 if any check fails, so it can be used as a regression suite;
+the throughput report makes it a scalability benchmark as well.
+"""
+import argparse
+import asyncio
+import heapq
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the auction lifecycle on a virtual clock")
+    parser.add_argument('--lots', type=int, default=2000, help="number of auction lots")
+    parser.add_argument('--bidders', type=int, default=300, help="number of bidding users")
+    parser.add_argument('--admins', type=int, default=2, help="number of admins")
+    parser.add_argument('--max-bids', type=int, default=6, help="maximum bids per lot")
+    parser.add_argument('--idle-share', type=float, default=0.05, help="share of lots that get no bids")
+    parser.add_argument('--spread-minutes', type=int, default=60, help="window in which first bids arrive")
+    parser.add_argument('--duration-minutes', type=int, default=None, help="auction duration (default: from config)")
+    parser.add_argument('--tick', type=int, default=30, help="virtual seconds per simulation step")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show handler logs")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def configure_environment(db_path: str, api_port: int):
+    """Point the bot at a throwaway database and the fake Bot API before project modules are imported"""
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{api_port}'
+    os.environ.setdefault('BOT_TOKEN', '123456:SIMULATION')
+    os.environ.setdefault('CHANNEL_ID', '@simulation')
+    # Bids arrive much faster in wall time than users could place them, one at a time,
+    # so there is nothing to throttle and no batch worth waiting for
+    os.environ['THROTTLE_LIMITS'] = ''
+    os.environ['BID_BATCH_SECONDS'] = '0'
+
+
+async def run(args, api_port: int) -> bool:
+    import clock
+
+    start = datetime(2030, 1, 1, 12, 0)
+    sim_clock = clock.VirtualClock(start)
+    clock.set_clock(sim_clock)
+
+    from aiogram.types import Update
+    from fake_telegram import FakeTelegram, make_callback_update
+
+    fake = FakeTelegram(seed=args.seed)
+    runner = await fake.start(port=api_port)
+
+    import bot as bot_module
+    import loader
+    import config
+    import scheduler
+    from database import db
+    from outbox import outbox
+    from utils import RateLimiter
+
+    bot = loader.bot
+    dp = loader.dp
+    bot_module.setup_dispatcher()
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    if args.duration_minutes:
+        config.EFFECTIVE_AUCTION_DURATION_MINUTES = args.duration_minutes
+    # Channel edits are not rate limited in virtual time
+    scheduler.channel_edit_limiter = RateLimiter(0)
+
+    rng = random.Random(args.seed)
+    await db.init_db()
+
+    # Record when each lot was finalized
+    completions = []
+    finalize_claimed_auctions = db.finalize_claimed_auctions
+
+    async def recording_finalize(*a, **kw):
+        lots = await finalize_claimed_auctions(*a, **kw)
+        for lot in lots:
+            completions.append((sim_clock.now(), lot['id']))
+        return lots
+
+    db.finalize_claimed_auctions = recording_finalize
+
+    # Users
+    owner_ids = list(range(1, 51))
+    bidder_ids = list(range(1000, 1000 + args.bidders))
+    admin_ids = list(range(900, 900 + args.admins))
+    for user_id in owner_ids + bidder_ids + admin_ids:
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}", f"+7700{user_id:07d}")
+    for admin_id in admin_ids:
+        await db.add_admin(admin_id)
+
+    # Lots, published in the channel, with planned bids
+    setup_started = time.perf_counter()
+    events = []  # (time, seq, kind, lot_id, user_id)
+    seq = 0
+    idle_lots = []
+    for i in range(args.lots):
+        photos = ','.join(f"photo_{i}_{n}" for n in range(1 if i % 3 else 3))
+        lot_id = await db.create_lot(
+            owner_id=rng.choice(owner_ids),
+            photos=photos,
+            description=f"Букет #{i}",
+            city="Алматы",
+            size="Средний",
+            wear="Сегодняшняя",
+            start_price=rng.randrange(5, 50) * 1000
+        )
+        await db.update_lot_status(lot_id, 'approved')
+        await db.update_lot_field(lot_id, 'channel_message_id', 100000 + lot_id * 10)
+        if i % 3 == 0:
+            await db.update_lot_field(lot_id, 'channel_button_message_id', 100000 + lot_id * 10 + 3)
+
+        if rng.random() < args.idle_share:
+            idle_lots.append(lot_id)
+            continue
+
+        first_bid = start + timedelta(seconds=rng.uniform(0, args.spread_minutes * 60))
+        heapq.heappush(events, (first_bid, seq, 'bid', lot_id, rng.choice(bidder_ids)))
+        seq += 1
+    setup_elapsed = time.perf_counter() - setup_started
+
+    duration = timedelta(minutes=config.EFFECTIVE_AUCTION_DURATION_MINUTES)
+    finish = start + timedelta(minutes=args.spread_minutes) + duration + timedelta(seconds=args.tick * 3)
+
+    end_times = {}
+    bids_left = {}
+    expected_outbid = 0
+    expected_reminders = 0
+    countdown_every = timedelta(seconds=config.COUNTDOWN_REFRESH_SECONDS)
+    sweep_every = timedelta(seconds=config.COMPLETION_SWEEP_SECONDS)
+    next_countdown = start
+    next_sweep = start
+
+    # Messages the handlers send in reply to the bidder, as opposed to notifications
+    handler_messages = 0
+    rejected_bids = []
+    message_ids = iter(range(10 ** 6, 10 ** 9))
+
+    async def feed(update: dict):
+        await dp.feed_update(bot, Update.model_validate(dict(update, update_id=0), context={'bot': bot}))
+
+    async def place_bid(lot_id: int, user_id: int):
+        nonlocal expected_outbid, seq, handler_messages
+        lot = await db.get_lot(lot_id)
+        if lot['status'] not in ('approved', 'active'):
+            return
+        amount = int(lot.get('current_price') or lot['start_price']) + 500
+
+        # The bid is confirmed through the real handler: bid actor, outbox rows, auction start
+        confirm_message_id = next(message_ids)
+        first_call = len(fake.calls)
+        await feed(make_callback_update(user_id, f"confirm_bid:{lot_id}:{amount}", message_id=confirm_message_id))
+        calls = fake.calls[first_call:]
+        handler_messages += sum(1 for call in calls if call['method'] == 'sendMessage')
+        if not any(call['method'] == 'editMessageText' and call['params'].get('message_id') == confirm_message_id
+                   and 'принята' in call['params'].get('text', '') for call in calls):
+            rejected_bids.append(lot_id)
+            return
+
+        previous_leader_id = lot.get('leader_id')
+        if previous_leader_id and previous_leader_id != user_id:
+            expected_outbid += 1
+
+        if not lot.get('auction_started'):
+            end_time = datetime.fromisoformat((await db.get_lot(lot_id))['end_time'])
+            end_times[lot_id] = end_time
+            bids_left[lot_id] = rng.randint(0, args.max_bids - 1)
+            # Same jobs schedule_auction_completion() registers
+            heapq.heappush(events, (end_time, seq, 'complete', lot_id, None))
+            heapq.heappush(events, (end_time - timedelta(minutes=5), seq + 1, 'notify', lot_id, None))
+            seq += 2
+
+        if bids_left[lot_id] > 0:
+            bids_left[lot_id] -= 1
+            next_time = sim_clock.now() + timedelta(seconds=rng.uniform(1, duration.total_seconds() * 0.9 / args.max_bids))
+            heapq.heappush(events, (next_time, seq, 'bid', lot_id, rng.choice(bidder_ids)))
+            seq += 1
+
+    completion_wall = 0.0
+    run_started = time.perf_counter()
+    while sim_clock.now() < finish:
+        step_end = sim_clock.now() + timedelta(seconds=args.tick)
+
+        while events and events[0][0] <= step_end:
+            moment, _, kind, lot_id, user_id = heapq.heappop(events)
+            sim_clock.set(max(sim_clock.now(), moment))
+            if kind == 'bid':
+                await place_bid(lot_id, user_id)
+            elif kind == 'notify':
+                expected_reminders += len(await db.get_lot_participants(lot_id))
+                await scheduler.notify_participants_before_end(lot_id, 5)
+            elif kind == 'complete':
+                started = time.perf_counter()
+                await scheduler.complete_auction(lot_id)
+                completion_wall += time.perf_counter() - started
+
+        sim_clock.set(step_end)
+        if sim_clock.now() >= next_countdown:
+            await scheduler.refresh_countdowns()
+            next_countdown += countdown_every
+        if sim_clock.now() >= next_sweep:
+            await scheduler.complete_due_auctions()
+            next_sweep += sweep_every
+        await outbox.flush()
+    run_elapsed = time.perf_counter() - run_started
+
+    # Checks
+    failures = []
+    if rejected_bids:
+        failures.append(f"{len(rejected_bids)} bids were not accepted, e.g. on lots {rejected_bids[:5]}")
+    completed = Counter(lot_id for _, lot_id in completions)
+    duplicates = [lot_id for lot_id, count in completed.items() if count > 1]
+    missing = [lot_id for lot_id in end_times if lot_id not in completed]
+    if duplicates:
+        failures.append(f"{len(duplicates)} auctions completed more than once, e.g. {duplicates[:5]}")
+    if missing:
+        failures.append(f"{len(missing)} auctions never completed, e.g. {missing[:5]}")
+
+    early = [lot_id for moment, lot_id in completions if moment < end_times[lot_id]]
+    late = [lot_id for moment, lot_id in completions if moment - end_times[lot_id] > timedelta(seconds=args.tick)]
+    if early:
+        failures.append(f"{len(early)} auctions completed before their end time, e.g. {early[:5]}")
+    if late:
+        failures.append(f"{len(late)} auctions completed more than one tick late, e.g. {late[:5]}")
+
+    # Batches finalized earlier must not contain auctions ending after ones finalized later
+    batches = defaultdict(list)
+    for moment, lot_id in completions:
+        batches[moment].append(end_times[lot_id])
+    previous_latest = None
+    out_of_order = 0
+    for moment in sorted(batches):
+        if previous_latest and min(batches[moment]) < previous_latest:
+            out_of_order += 1
+        previous_latest = max(batches[moment])
+    if out_of_order:
+        failures.append(f"{out_of_order} completion batches out of end-time order")
+
+    lots = {lot_id: await db.get_lot(lot_id) for lot_id in end_times}
+    expected_completion = 0
+    for lot_id, lot in lots.items():
+        participants = await db.get_lot_participants(lot_id)
+        if lot['status'] == 'finished':
+            expected_completion += 2 + args.admins + len(participants) - 1
+        else:
+            failures.append(f"Lot {lot_id} ended with status {lot['status']}")
+
+    sent = fake.count('sendMessage') - handler_messages
+    expected_sent = expected_completion + expected_outbid + expected_reminders
+    if sent != expected_sent:
+        failures.append(f"Sent {sent} notifications, expected {expected_sent}")
+
+    outbox_stats = await db.get_outbox_stats()
+    if set(outbox_stats) - {'sent'}:
+        failures.append(f"Outbox not drained: {outbox_stats}")
+
+    channel = str(config.CHANNEL_ID)
+    channel_edits = [call['params'] for call in fake.calls
+                     if call['method'] in ('editMessageCaption', 'editMessageText')
+                     and str(call['params'].get('chat_id')) == channel]
+    sold_edits = sum(1 for params in channel_edits if params.get('reply_markup') is None)
+    if sold_edits != len(end_times):
+        failures.append(f"{sold_edits} channel posts marked as sold, expected {len(end_times)}")
+    countdown_edits = len(channel_edits) - sold_edits
+
+    for lot_id in idle_lots:
+        lot = await db.get_lot(lot_id)
+        if lot['status'] != 'approved':
+            failures.append(f"Lot {lot_id} without bids changed status to {lot['status']}")
+
+    # Report
+    span = sim_clock.now() - start
+    print(f"Lots: {args.lots} ({len(end_times)} auctions, {len(idle_lots)} without bids), setup {setup_elapsed:.1f}s")
+    print(f"Virtual time: {span}, wall time: {run_elapsed:.1f}s ({span.total_seconds() / run_elapsed:.0f}x)")
+    print(f"Completion: {len(completions)} auctions in {completion_wall:.2f}s "
+          f"({len(completions) / completion_wall if completion_wall else 0:.0f} auctions/s)")
+    print(f"Notifications: {sent} (completion {expected_completion}, outbid {expected_outbid}, "
+          f"reminders {expected_reminders})")
+    print(f"Channel edits: {sold_edits} sold, {countdown_edits} countdown and new bid")
+
+    await runner.cleanup()
+    await loader.storage.close()
+    await bot.session.close()
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return False
+
+    print("\nOK")
+    return True
+
+
+def main():
+    args = parse_args()
+    api_port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(os.path.join(tmp, 'simulation.db'), api_port)
+        ok = asyncio.run(run(args, api_port))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
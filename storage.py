@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from cache import TTLCache
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in the bot database with a short-lived write-through LRU cache.
+
+    Several instances may share the database, so only stored states are cached, and
+    only for FSM_CACHE_TTL_SECONDS: a state another instance wrote or cleared is seen
+    within that time, a state it created right away.
+    """
+
+    def __init__(self, db_path: str = config.DATABASE_PATH, ttl: float = config.FSM_STATE_TTL_SECONDS,
+                 cache_size: int = config.FSM_CACHE_SIZE, cache_ttl: float = config.FSM_CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        # States untouched for longer than ttl are treated as abandoned
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # {key: (state, data)} of stored states; misses always go to the database
+        self.cache = TTLCache('fsm', maxsize=cache_size, ttl=cache_ttl)
+        self._db: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connection(self) -> aiosqlite.Connection:
+        """Single long-lived connection, opened on first use"""
+        if self._db is not None:
+            return self._db
+
+        async with self._connect_lock:
+            if self._db is not None:
+                return self._db
+
+            db = await aiosqlite.connect(self.db_path)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            await db.execute(
+                "DELETE FROM fsm_storage WHERE updated_at < ?", (time.time() - self.ttl,)
+            )
+            await db.commit()
+            self._db = db
+        return self._db
+
+    async def _load(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        storage_key = self.key_builder.build(key)
+        record = self.cache.get(storage_key)
+        if record is not None:
+            return record
+
+        db = await self._connection()
+        async with db.execute(
+            "SELECT state, data, updated_at FROM fsm_storage WHERE key = ?", (storage_key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if not row or row[2] < time.time() - self.ttl:
+            return None, {}
+        record = (row[0], json.loads(row[1]) if row[1] else {})
+        self.cache.set(storage_key, record)
+        return record
+
+    async def _save(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        storage_key = self.key_builder.build(key)
+        db = await self._connection()
+        if state is None and not data:
+            await db.execute("DELETE FROM fsm_storage WHERE key = ?", (storage_key,))
+            await db.commit()
+            # Not cached as empty: another instance may set a state meanwhile
+            self.cache.pop(storage_key)
+            return
+
+        await db.execute("""
+            INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                updated_at = excluded.updated_at
+        """, (storage_key, state, json.dumps(data, ensure_ascii=False), time.time()))
+        await db.commit()
+        self.cache.set(storage_key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._load(key)
+        await self._save(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = await self._load(key)
+        await self._save(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(key)
+        return data.copy()
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+        self.cache.clear()
@@ -0,0 +1,65 @@
+import functools
+import inspect
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# Breakdown of the update being handled: {'handler': name, 'db': seconds, 'db_calls': n, ...}
+_current: ContextVar[Optional[Dict[str, Any]]] = ContextVar('update_timing', default=None)
+# Kind of the timed call we are inside, so nested calls aren't counted twice
+_inside: ContextVar[Optional[str]] = ContextVar('timing_inside', default=None)
+
+
+def start_update_timing():
+    """Start collecting time breakdown for the current update, returns (record, token)"""
+    record = {'handler': None, 'db': 0.0, 'db_calls': 0, 'api': 0.0, 'api_calls': 0}
+    return record, _current.set(record)
+
+
+def finish_update_timing(token):
+    _current.reset(token)
+
+
+def get_update_timing() -> Optional[Dict[str, Any]]:
+    """Breakdown of the update being handled, None outside of update handling"""
+    return _current.get()
+
+
+def add_timing(kind: str, seconds: float):
+    """Add time spent in a DB or Bot API call to the current update"""
+    record = _current.get()
+    if record is not None:
+        record[kind] += seconds
+        record[f'{kind}_calls'] += 1
+
+
+def timed(kind: str, histogram=None):
+    """Decorator for coroutines whose time should be added to the current update (and `histogram` by method)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _inside.get() == kind:
+                return await func(*args, **kwargs)
+
+            token = _inside.set(kind)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                add_timing(kind, elapsed)
+                if histogram is not None:
+                    histogram.observe(elapsed, method=func.__name__)
+                _inside.reset(token)
+        return wrapper
+    return decorator
+
+
+def timed_methods(kind: str, histogram=None):
+    """Class decorator applying timed(kind, histogram) to all public coroutine methods"""
+    def decorator(cls):
+        for name, method in list(vars(cls).items()):
+            if not name.startswith('_') and inspect.iscoroutinefunction(method):
+                setattr(cls, name, timed(kind, histogram)(method))
+        return cls
+    return decorator
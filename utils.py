@@ -1,8 +1,18 @@
+import asyncio
+import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, Hashable, List, Optional
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, InputMediaPhoto
+from cache import TTLCache
+import clock
 import config
 
+logger = logging.getLogger(__name__)
+
+# Rendered lot texts: {(lot_id, version, template): text}
+rendered_texts = TTLCache('renders', maxsize=config.RENDER_CACHE_SIZE, ttl=config.RENDER_CACHE_TTL_SECONDS)
+
 
 def format_price(price: float) -> str:
     """Format price with spaces as thousand separator"""
@@ -15,15 +25,37 @@ async def is_admin(user_id: int) -> bool:
     return await db.is_admin(user_id)
 
 
-async def get_user_menu(user_id: int):
-    """Get appropriate menu for user (admin or regular)"""
-    from keyboards import get_main_menu, get_admin_menu
-    user_is_admin = await is_admin(user_id)
+async def get_user_menu(user_id: int, user_is_admin: Optional[bool] = None):
+    """Get appropriate menu for user (admin or regular); pass the handler's user_is_admin to skip the lookup"""
+    from keyboards import get_main_menu
+    if user_is_admin is None:
+        user_is_admin = await is_admin(user_id)
     return get_main_menu(is_admin=user_is_admin)
 
 
+def cached_render(lot: Dict[str, Any], template: Hashable, render: Callable[[], str]) -> str:
+    """Render once per (lot_id, version, template); lots without a version are always rendered"""
+    version = lot.get('version')
+    if version is None or lot.get('id') is None:
+        return render()
+
+    key = (lot['id'], version, template)
+    text = rendered_texts.get(key)
+    if text is None:
+        text = render()
+        rendered_texts.set(key, text)
+    return text
+
+
 def format_lot_message(lot: Dict[str, Any], include_price: bool = True, include_terms_link: bool = False) -> str:
     """Format lot information for display"""
+    return cached_render(
+        lot, ('lot', include_price),
+        lambda: _render_lot_message(lot, include_price)
+    )
+
+
+def _render_lot_message(lot: Dict[str, Any], include_price: bool) -> str:
     text = f"<b>Описание:</b> {lot['description']}\n"
     text += f"<b>Город:</b> {lot['city']}\n"
     text += f"<b>Размер:</b> {lot['size']}\n"
@@ -47,6 +79,10 @@ def format_lot_message(lot: Dict[str, Any], include_price: bool = True, include_
 
 def format_auction_status(lot: Dict[str, Any]) -> str:
     """Format auction status text"""
+    return cached_render(lot, 'status', lambda: _render_status_header(lot)) + format_countdown(lot)
+
+
+def _render_status_header(lot: Dict[str, Any]) -> str:
     status_text = ""
 
     # Show current bid if exists
@@ -54,31 +90,56 @@ def format_auction_status(lot: Dict[str, Any]) -> str:
         status_text += f"\n🔥 <b>Топовая ставка:</b> {format_price(lot['current_price'])} тенге"
 
     if not lot.get('auction_started'):
-        return status_text + "\n<b>Статус:</b> До начала аукциона"
+        status_text += "\n<b>Статус:</b> До начала аукциона"
 
-    if lot['end_time']:
-        end_time = datetime.fromisoformat(lot['end_time'])
-        now = datetime.now()
+    return status_text
 
-        if now >= end_time:
-            return status_text + "\n<b>Статус:</b> Завершено"
 
-        remaining = end_time - now
-        hours = remaining.seconds // 3600
-        minutes = (remaining.seconds % 3600) // 60
+def format_countdown(lot: Dict[str, Any]) -> str:
+    """Time left until the auction ends, the only part of the status that is never cached"""
+    if not lot.get('auction_started') or not lot['end_time']:
+        return ""
 
-        if hours > 0:
-            if minutes > 0:
-                return status_text + f"\n<b>До завершения:</b> {hours} ч {minutes} мин"
-            return status_text + f"\n<b>До завершения:</b> {hours} ч"
-        else:
-            return status_text + f"\n<b>До завершения:</b> {minutes} мин"
+    end_time = datetime.fromisoformat(lot['end_time'])
+    now = clock.now()
 
-    return status_text
+    if now >= end_time:
+        return "\n<b>Статус:</b> Завершено"
+
+    remaining = end_time - now
+    hours = remaining.seconds // 3600
+    minutes = (remaining.seconds % 3600) // 60
+
+    if hours > 0:
+        if minutes > 0:
+            return f"\n<b>До завершения:</b> {hours} ч {minutes} мин"
+        return f"\n<b>До завершения:</b> {hours} ч"
+    else:
+        return f"\n<b>До завершения:</b> {minutes} мин"
+
+
+def render_lot_caption(lot: Dict[str, Any]) -> str:
+    """Lot caption for browsing in the bot"""
+    caption = cached_render(lot, 'caption', lambda: _render_caption_body(lot))
+    if lot['lot_type'] == 'auction' and lot.get('auction_started'):
+        caption += format_auction_status(lot)
+    return caption
+
+
+def _render_caption_body(lot: Dict[str, Any]) -> str:
+    if lot['lot_type'] == 'auction':
+        caption = "🔥 <b>Аукцион</b>\n\n"
+    else:
+        caption = "💐 <b>Букет на продажу</b>\n\n"
+    return caption + format_lot_message(lot)
 
 
 def format_sold_message(lot: Dict[str, Any], final_price: float = None) -> str:
     """Format message for sold items"""
+    return cached_render(lot, ('sold', final_price), lambda: _render_sold_message(lot, final_price))
+
+
+def _render_sold_message(lot: Dict[str, Any], final_price: Optional[float]) -> str:
     text = "🔴 <b>ПРОДАНО</b>\n\n"
     text += f"<b>Описание:</b> {lot['description']}\n"
     text += f"<b>Город:</b> {lot['city']}\n"
@@ -120,6 +181,69 @@ def create_media_group(photos: List[str], caption: str = None) -> List[InputMedi
     return media
 
 
+def get_channel_album_ids(lot: Dict[str, Any]) -> List[int]:
+    """Message IDs of the lot's media group in the channel, empty if they can't be trusted"""
+    photos = get_photos_list(lot['photos'])
+    first_id = lot.get('channel_message_id')
+    if not first_id or len(photos) < 2:
+        return []
+
+    # The album is followed by the button message; if it sits right after the last photo,
+    # nothing was posted in between and the album IDs are contiguous
+    if lot.get('channel_button_message_id') != first_id + len(photos):
+        return []
+    return list(range(first_id, first_id + len(photos)))
+
+
+async def send_lot_media(chat_id: int, lot: Dict[str, Any], caption: str, reply_markup=None) -> bool:
+    """Send lot photos to a user, copying the channel post when the lot is published
+
+    Returns False if a channel album was copied with its own caption and the caller
+    has to send the caption separately. Albums can't carry a keyboard either way.
+    """
+    from loader import bot
+
+    photos = get_photos_list(lot['photos'])
+
+    if not photos:
+        await bot.send_message(chat_id=chat_id, text=caption, parse_mode="HTML", reply_markup=reply_markup)
+        return True
+
+    try:
+        if len(photos) == 1 and lot.get('channel_message_id'):
+            # Copy references the uploaded photo, caption and keyboard can be replaced
+            await bot.copy_message(
+                chat_id=chat_id,
+                from_chat_id=config.CHANNEL_ID,
+                message_id=lot['channel_message_id'],
+                caption=caption,
+                parse_mode="HTML",
+                reply_markup=reply_markup
+            )
+            return True
+
+        album_ids = get_channel_album_ids(lot)
+        if album_ids:
+            await bot.copy_messages(chat_id=chat_id, from_chat_id=config.CHANNEL_ID, message_ids=album_ids)
+            return False
+    except TelegramBadRequest as e:
+        # Channel post deleted or inaccessible - upload the photos instead
+        logger.warning(f"Failed to copy channel post of lot {lot['id']}: {e}")
+
+    if len(photos) == 1:
+        await bot.send_photo(
+            chat_id=chat_id,
+            photo=photos[0],
+            caption=caption,
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+        return True
+
+    await bot.send_media_group(chat_id=chat_id, media=create_media_group(photos, caption))
+    return True
+
+
 def get_time_intervals() -> List[int]:
     """Get time intervals for auction updates (in minutes from end)"""
     total = config.EFFECTIVE_AUCTION_DURATION_MINUTES
@@ -134,15 +258,26 @@ def get_time_intervals() -> List[int]:
         return [120, 90, 60, 30, 10, 5, 0]
 
 
+def get_due_checkpoint(end_time: datetime, now: datetime = None) -> Optional[int]:
+    """Get the latest checkpoint (minutes before end) the auction has already reached"""
+    now = now or clock.now()
+    remaining_minutes = (end_time - now).total_seconds() / 60
+    # Checkpoint 0 is the completion itself, it is handled by complete_auction
+    reached = [minutes for minutes in get_time_intervals() if minutes > 0 and remaining_minutes <= minutes]
+    return min(reached) if reached else None
+
+
 def calculate_end_time() -> datetime:
     """Calculate auction end time using effective minutes"""
-    return datetime.now() + timedelta(minutes=config.EFFECTIVE_AUCTION_DURATION_MINUTES)
+    return clock.now() + timedelta(minutes=config.EFFECTIVE_AUCTION_DURATION_MINUTES)
+
+
+# Минимальный шаг ставки
+MIN_BID_STEP = 500
 
 
 def validate_bid(amount: float, start_price: float, current_price: float = None) -> tuple[bool, str]:
     """Validate bid amount"""
-    MIN_BID_STEP = 500  # Минимальный шаг ставки
-
     # Определяем минимальную требуемую ставку
     if current_price:
         required_bid = current_price + MIN_BID_STEP
@@ -184,3 +319,22 @@ async def safe_edit_message(message: Message, text: str, **kwargs):
         await message.edit_text(text, **kwargs)
     except Exception:
         pass
+
+
+class RateLimiter:
+    """Spread calls evenly so that no more than `rate` calls start per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Wait for the next free slot"""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+                now = self._next_slot
+            self._next_slot = now + self.interval
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import signal
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+async def set_webhook(bot: Bot, dispatcher: Dispatcher):
+    """Register webhook URL with Telegram"""
+    if not config.WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL is not set - webhook is not registered, updates must be POSTed manually")
+        return
+
+    url = config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH
+    await bot.set_webhook(
+        url=url,
+        secret_token=config.WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types()
+    )
+    logger.info(f"Webhook set to {url}")
+
+
+def create_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """aiohttp application that feeds webhook updates into the dispatcher"""
+    app = web.Application()
+
+    # Requests without the matching X-Telegram-Bot-Api-Secret-Token header get 401
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET
+    ).register(app, path=config.WEBHOOK_PATH)
+
+    # Runs dp.startup / dp.shutdown hooks together with the web app
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Serve webhook updates until SIGTERM/SIGINT or cancellation"""
+    if not config.WEBHOOK_SECRET:
+        logger.warning("⚠️ WEBHOOK_SECRET not configured - webhook endpoint accepts any request!")
+
+    dp.startup.register(set_webhook)
+    app = create_app(dp, bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBAPP_HOST, config.WEBAPP_PORT)
+    await site.start()
+    logger.info(f"Listening for webhook updates on {config.WEBAPP_HOST}:{config.WEBAPP_PORT}{config.WEBHOOK_PATH}")
+
+    # Stop on SIGTERM/SIGINT like polling does; cleanup closes the listener first, then runs dp.shutdown
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Not available on Windows
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()